@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+    fakeserver
+    ~~~~~~~~~~
+
+    An in-memory stand-in for the Transfluent API, used to benchmark the
+    client without touching the real service.
+
+    :class:`FakeTransfluent` is a WSGI application implementing the `/v2/`
+    endpoints the client uses.  :func:`serve` runs it on a local keep-alive
+    HTTP/1.1 server that also understands chunked request bodies, which the
+    stdlib WSGI server does not.
+
+    :copyright: (c) 2013-2016 by Janne Vanhala.
+    :license: BSD, see LICENSE for more details.
+"""
+import base64
+import io
+import json
+import subprocess
+import sys
+import threading
+from collections import defaultdict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+LANGUAGES = [[1, 'en-gb', 'English (GB)'], [11, 'fi-fi', 'Finnish']]
+
+
+class FakeTransfluent(object):
+    """
+    A WSGI application that emulates the Transfluent API.  Texts and files
+    are kept in memory, and file translations complete immediately.
+    """
+
+    def __init__(self):
+        self.texts = defaultdict(dict)
+        self.files = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.routes = {
+            ('GET', 'authenticate'): self.authenticate,
+            ('GET', 'languages'): self.languages,
+            ('GET', 'customer/name'): lambda params: 'John Doe',
+            ('POST', 'customer/name'): lambda params: 'OK',
+            ('GET', 'customer/email'): lambda params: 'john@example.com',
+            ('POST', 'customer/email'): lambda params: 'OK',
+            ('POST', 'texts'): self.texts_save,
+            ('GET', 'texts'): self.texts_read,
+            ('GET', 'texts/translate'): self.texts_translate,
+            ('POST', 'file/save'): self.file_save,
+            ('GET', 'file/status'): self.file_status,
+            ('POST', 'file/translate'): self.file_translate,
+            ('GET', 'file/read'): self.file_read,
+        }
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.requests += 1
+        method = environ['REQUEST_METHOD']
+        path = environ['PATH_INFO']
+        if path.startswith('/v2/'):
+            path = path[len('/v2/'):]
+        params = parse_qsl(environ.get('QUERY_STRING', ''), True)
+        if method == 'POST':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length)
+            params.extend(parse_qsl(body.decode('utf-8'), True))
+        multi = defaultdict(list)
+        for key, value in params:
+            multi[key].append(value)
+        route = self.routes.get((method, path.rstrip('/')))
+        if route is None:
+            return self._error(
+                start_response, '404 Not Found', 'EBackendMethodNotFound',
+                'Unknown method'
+            )
+        rv = route(multi)
+        if isinstance(rv, bytes):
+            start_response('200 OK', [
+                ('Content-Type', 'application/octet-stream'),
+                ('Content-Length', str(len(rv))),
+            ])
+            return [rv]
+        return self._json(start_response, '200 OK', {
+            'status': 'OK',
+            'response': rv,
+        })
+
+    def _json(self, start_response, status, data):
+        body = json.dumps(data).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
+
+    def _error(self, start_response, status, type, message):
+        return self._json(start_response, status, {
+            'status': 'ERROR',
+            'error': {'type': type, 'message': message},
+            'response': 'Unfortunately an error occured.',
+        })
+
+    def authenticate(self, params):
+        return {'token': 'fake-token'}
+
+    def languages(self, params):
+        return LANGUAGES
+
+    def texts_save(self, params):
+        group = (params['group_id'][0], params['language'][0])
+        texts = self.texts[group]
+        for key, values in params.items():
+            if key.startswith('texts[') and key.endswith(']'):
+                texts[key[len('texts['):-1]] = values[-1]
+        return {'word_count': len(texts)}
+
+    def texts_read(self, params):
+        texts = self.texts[(params['group_id'][0], params['language'][0])]
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', ['100'])[0])
+        keys = sorted(texts)[offset:offset + limit]
+        return [{'id': key, 'text': texts[key]} for key in keys]
+
+    def texts_translate(self, params):
+        texts = self.texts[(params['group_id'][0],
+                            params['source_language'][0])]
+        words = sum(len(texts.get(key, '').split())
+                    for key in params.get('texts[][id]', []))
+        return {'word_count': words}
+
+    def file_save(self, params):
+        content = base64.b64decode(params['content'][0])
+        key = (params['identifier'][0], params['language'][0])
+        self.files[key] = content
+        return {'word_count': len(content.split())}
+
+    def file_status(self, params):
+        return {'progress': '100%'}
+
+    def file_translate(self, params):
+        content = self.files.get(
+            (params['identifier'][0], params['language'][0]), b''
+        )
+        for language in params.get('target_languages[]', []):
+            self.files[(params['identifier'][0], language)] = content
+        return {'word_count': len(content.split())}
+
+    def file_read(self, params):
+        return self.files.get(
+            (params['identifier'][0], params['language'][0]), b''
+        )
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _WSGIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _handle(self):
+        body = self._read_body()
+        path, _, query = self.path.partition('?')
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        status_headers = []
+
+        def start_response(status, headers):
+            status_headers[:] = [status, headers]
+
+        chunks = self.server.app(environ, start_response)
+        status, headers = status_headers
+        code, _, reason = status.partition(' ')
+        self.send_response(int(code), reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeServer(object):
+    """
+    Serves a WSGI application on a local port in a background thread.
+    :attr:`url` is the base URL to pass to the client.
+    """
+
+    def __init__(self, app=None, host='127.0.0.1', port=0):
+        self.app = app or FakeTransfluent()
+        self._server = _ThreadingServer((host, port), _WSGIRequestHandler)
+        self._server.app = self.app
+        self.url = 'http://{0}:{1}/v2/'.format(*self._server.server_address)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeServerProcess(object):
+    """
+    Serves :class:`FakeTransfluent` from a child process, so that the
+    server's allocations are not counted when measuring the client's
+    memory.  :attr:`url` is the base URL to pass to the client.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(
+            [sys.executable, __file__, self.host, str(self.port)],
+            stdout=subprocess.PIPE
+        )
+        self.url = self._process.stdout.readline().decode('ascii').strip()
+        if not self.url:
+            self._process.wait()
+            raise RuntimeError('the fake server did not start')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._process.terminate()
+        self._process.wait()
+        self._process.stdout.close()
+
+
+def serve(host='127.0.0.1', port=8000):
+    """
+    Run the fake API in the foreground until interrupted.  The base URL is
+    written to stdout once the server listens, which lets `port` be `0`.
+    """
+    server = _ThreadingServer((host, port), _WSGIRequestHandler)
+    server.app = FakeTransfluent()
+    url = 'http://{0}:{1}/v2/'.format(*server.server_address)
+    sys.stderr.write('Serving the fake Transfluent API on {0}\n'.format(url))
+    sys.stdout.write(url + '\n')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    serve(*sys.argv[1:2] + [int(port) for port in sys.argv[2:3]])
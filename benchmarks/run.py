@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+    run
+    ~~~
+
+    Benchmarks the Transfluent client against a local fake server.
+
+    Each scenario is run `--repeat` times and reports latency percentiles,
+    throughput and the peak Python memory allocated while it ran.  The
+    fake server runs in a child process so that only the client's
+    allocations are counted, except with the `wsgi` transport, which calls
+    the fake API in-process.  The results are written as JSON, and can be
+    compared against a previous run to catch regressions::
+
+        $ python benchmarks/run.py --output baseline.json
+        $ python benchmarks/run.py --compare baseline.json
+
+    :copyright: (c) 2013-2016 by Janne Vanhala.
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transfluent  # noqa
+from fakeserver import FakeServer, FakeServerProcess  # noqa
+
+GROUP = 'benchmark/messages'
+LANGUAGE = 1
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * len(values))))
+    return values[index]
+
+
+def summarize(name, size, latencies, peak_memory, payload_bytes):
+    total = sum(latencies)
+    return {
+        'name': name,
+        'size': size,
+        'repeat': len(latencies),
+        'latency': {
+            'min': min(latencies),
+            'mean': total / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+        },
+        'throughput': {
+            'ops_per_second': len(latencies) / total if total else None,
+            'bytes_per_second': (
+                payload_bytes * len(latencies) / total if total else None
+            ),
+        },
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def measure(name, size, payload_bytes, func, repeat, setup=None):
+    latencies = []
+    peak = 0
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return summarize(name, size, latencies, peak, payload_bytes)
+
+
+def make_texts(count):
+    return dict(
+        ('key{0}'.format(i), u'Source text number {0}'.format(i))
+        for i in range(count)
+    )
+
+
+def make_file(size):
+    line = b'msgid "Hello World"\nmsgstr ""\n\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def bench_texts_save(client, repeat, sizes):
+    for count in sizes:
+        texts = make_texts(count)
+        payload = sum(len(k) + len(v) for k, v in texts.items())
+        yield measure(
+            'texts_save', count, payload,
+            lambda: client.texts_save(GROUP, LANGUAGE, texts), repeat
+        )
+
+
+def bench_texts_read(client, repeat, sizes):
+    for count in sizes:
+        client.texts_save(GROUP + str(count), LANGUAGE, make_texts(count))
+        yield measure(
+            'texts_read_paging', count, 0,
+            lambda: sum(1 for _ in client.iter_texts(
+                GROUP + str(count), LANGUAGE, page_size=100
+            )),
+            repeat
+        )
+
+
+def bench_file_save(client, repeat, sizes):
+    for size in sizes:
+        content = make_file(size)
+        yield measure(
+            'file_save', size, size,
+            lambda f: client.file_save('bench', LANGUAGE, f, 'po-file'),
+            repeat, setup=lambda: (io.BytesIO(content),)
+        )
+        yield measure(
+            'file_save_streaming', size, size,
+            lambda f: client.file_save_streaming(
+                'bench', LANGUAGE, f, 'po-file'
+            ),
+            repeat, setup=lambda: (io.BytesIO(content),)
+        )
+
+
+def bench_file_read(client, repeat, sizes):
+    for size in sizes:
+        identifier = 'bench-read-{0}'.format(size)
+        client.file_save(identifier, LANGUAGE, io.BytesIO(make_file(size)),
+                         'po-file')
+        yield measure(
+            'file_read', size, size,
+            lambda: client.file_read(identifier, LANGUAGE), repeat
+        )
+
+
+def bench_form_encoding(client, repeat, sizes):
+    from requests.models import RequestEncodingMixin
+    for count in sizes:
+        texts = make_texts(count)
+        payload = sum(len(k) + len(v) for k, v in texts.items())
+
+        def encode_dict():
+            # The dict of bracketed keys the client used to build, encoded
+            # the way requests encodes form data.
+            data = {'token': 'fake-token', 'group_id': GROUP,
+                    'language': LANGUAGE, 'invalidate_translations': 1}
+            for key, content in texts.items():
+                data['texts[{0}]'.format(key)] = content
+            return RequestEncodingMixin._encode_params(data)
+
+        yield measure('encode_texts_dict', count, payload, encode_dict,
+                      repeat)
+        yield measure(
+            'encode_texts_form', count, payload,
+            lambda: transfluent.encode_form(
+                [('token', 'fake-token'), ('group_id', GROUP),
+                 ('language', LANGUAGE), ('invalidate_translations', 1)],
+                ('texts', texts)
+            ),
+            repeat
+        )
+
+
+SCENARIOS = {
+    'texts_save': (bench_texts_save, [100, 1000, 10000]),
+    'texts_read': (bench_texts_read, [100, 1000, 10000]),
+    'file_save': (bench_file_save, [64 * 1024, 1024 * 1024,
+                                    8 * 1024 * 1024]),
+    'file_read': (bench_file_read, [64 * 1024, 1024 * 1024,
+                                    8 * 1024 * 1024]),
+    'form_encoding': (bench_form_encoding, [1000, 10000, 100000]),
+}
+
+
+TRANSPORTS = {
+    'requests': lambda server: transfluent.RequestsTransport(),
+    'http.client': lambda server: transfluent.HTTPClientTransport(),
+    'wsgi': lambda server: transfluent.WSGITransport(server.app),
+}
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the scenarios whose median latency regressed by more than
+    `threshold` (a fraction) compared to `baseline`.
+    """
+    before = dict(((r['name'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        old = before.get((result['name'], result['size']))
+        if old is None:
+            continue
+        ratio = result['latency']['p50'] / old['latency']['p50']
+        if ratio > 1 + threshold:
+            regressions.append({
+                'name': result['name'],
+                'size': result['size'],
+                'before': old['latency']['p50'],
+                'after': result['latency']['p50'],
+                'ratio': ratio,
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run: {0} (default: all)'.format(
+                            ', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--transport', default='requests',
+                        choices=sorted(TRANSPORTS),
+                        help='the transport to benchmark (default: requests)')
+    parser.add_argument('--quick', action='store_true',
+                        help='only run the smallest size of each scenario')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='fail if p50 latencies regressed compared to '
+                             'this earlier JSON output')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed p50 regression (default: 0.2)')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: {0}'.format(', '.join(unknown)))
+
+    results = {
+        'transfluent': transfluent.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'transport': args.transport,
+        'timestamp': time.time(),
+        'results': [],
+    }
+    server = FakeServer() if args.transport == 'wsgi' else FakeServerProcess()
+    with server:
+        client = transfluent.Transfluent(
+            token='fake-token', url=server.url,
+            transport=TRANSPORTS[args.transport](server)
+        )
+        for name in args.scenarios or sorted(SCENARIOS):
+            bench, sizes = SCENARIOS[name]
+            if args.quick:
+                sizes = sizes[:1]
+            for result in bench(client, args.repeat, sizes):
+                results['results'].append(result)
+                sys.stderr.write(
+                    '{name:<22} {size:>9}  p50 {p50:8.4f}s  '
+                    'p99 {p99:8.4f}s  peak {peak:>11} B\n'.format(
+                        name=result['name'], size=result['size'],
+                        p50=result['latency']['p50'],
+                        p99=result['latency']['p99'],
+                        peak=result['peak_memory_bytes']
+                    )
+                )
+        client.close()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            sys.stderr.write(
+                'REGRESSION {name} {size}: p50 {before:.4f}s -> '
+                '{after:.4f}s ({ratio:.2f}x)\n'.format(**regression)
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    startup
+    ~~~~~~~
+
+    Benchmarks how long a fresh Python process takes to import the client
+    and to make a single call with each transport, which is what command
+    line tools, hooks and serverless functions pay on every run::
+
+        $ python benchmarks/startup.py --repeat 20
+
+    Each measurement runs in a new interpreter, so the import caches of
+    earlier runs do not hide the cost.  The time of an empty interpreter is
+    reported as the baseline.
+
+    :copyright: (c) 2013-2016 by Janne Vanhala.
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakeserver import FakeServer  # noqa
+
+CALL = (
+    'import transfluent; '
+    'client = transfluent.Transfluent(token="fake-token", url={url!r}, '
+    'transport={transport!r}); '
+    'client.file_status("bench", 1)'
+)
+
+
+def scenarios(url):
+    yield 'python', 'pass'
+    yield 'import', 'import transfluent'
+    for transport in ('requests', 'http.client'):
+        yield 'call ({0})'.format(transport), CALL.format(
+            url=url, transport=transport
+        )
+
+
+def measure(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'min': timings[0],
+        'p50': timings[len(timings) // 2],
+        'max': timings[-1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'timestamp': time.time(),
+        'results': [],
+    }
+    with FakeServer() as server:
+        for name, code in scenarios(server.url):
+            result = measure(code, args.repeat)
+            result['name'] = name
+            results['results'].append(result)
+            sys.stderr.write(
+                '{name:<20} min {min:8.4f}s  p50 {p50:8.4f}s\n'.format(
+                    **result
+                )
+            )
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,12 +25,21 @@ setup(
     author='Janne Vanhala',
     author_email='janne.vanhala@gmail.com',
     url='http://github.com/jpvanhal/python-transfluent',
-    py_modules=['transfluent'],
+    py_modules=['transfluent', 'transfluent_async'],
     license=open('LICENSE').read(),
     platforms='any',
     install_requires=[
         'requests>=1.0',
     ],
+    entry_points={
+        'console_scripts': [
+            'transfluent = transfluent:main',
+        ],
+    },
+    extras_require={
+        'async': ['aiohttp>=2.0'],
+        'fast': ['orjson'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -1,3 +1,8 @@
+import base64
+import hashlib
+import os
+import random
+import time
 from io import BytesIO
 
 from flexmock import flexmock
@@ -19,6 +24,7 @@ def make_response(content, status_code=200):
     response = requests.Response()
     response.status_code = status_code
     response._content = content
+    response._content_consumed = True
     response.encoding = 'utf-8'
     return response
 
@@ -50,10 +56,71 @@ class TestTransfluent(object):
         client = make_transfluent()
         assert client._transfluent_url == 'https://transfluent.com/v2/'
 
+    def test_constructor_sets_custom_transfluent_url(self):
+        client = make_transfluent(url='http://localhost:8000/v2/')
+        assert client._transfluent_url == 'http://localhost:8000/v2/'
+
+    def test_constructor_creates_pooled_session(self):
+        client = make_transfluent(pool_connections=3, pool_maxsize=7)
+        adapter = client.session.get_adapter('https://transfluent.com/v2/')
+        assert isinstance(client.session, requests.Session)
+        assert adapter._pool_connections == 3
+        assert adapter._pool_maxsize == 7
+
+    def test_constructor_uses_given_session(self):
+        session = requests.Session()
+        client = make_transfluent(session=session)
+        assert client.session is session
+
+    def test_close_closes_owned_session(self):
+        client = make_transfluent()
+        flexmock(client.session).should_receive('close').once()
+        client.close()
+
+    def test_close_does_not_close_given_session(self):
+        session = requests.Session()
+        flexmock(session).should_receive('close').never()
+        client = make_transfluent(session=session)
+        client.close()
+
+    def test_context_manager_closes_session(self):
+        client = make_transfluent()
+        flexmock(client.session).should_receive('close').once()
+        with client as rv:
+            assert rv is client
+
+    def test_constructor_selects_transport_by_name(self):
+        from transfluent import HTTPClientTransport
+        client = make_transfluent(transport='http.client')
+        assert isinstance(client.transport, HTTPClientTransport)
+
+    def test_constructor_rejects_unknown_transport(self):
+        with pytest.raises(ValueError):
+            make_transfluent(transport='carrier-pigeon')
+
+    def test_constructor_falls_back_without_requests(self, monkeypatch):
+        import sys
+        from transfluent import HTTPClientTransport
+        monkeypatch.setitem(sys.modules, 'requests', None)
+        client = make_transfluent()
+        assert isinstance(client.transport, HTTPClientTransport)
+
+    def test_import_does_not_import_requests(self):
+        import subprocess
+        import sys
+        code = (
+            'import sys, transfluent; '
+            'sys.exit("requests" in sys.modules or '
+            '"multiprocessing" in sys.modules)'
+        )
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        assert subprocess.call([sys.executable, '-c', code], cwd=cwd) == 0
+
     def test_request_on_successful_json_response(self):
         response = make_response(b'{"status":"OK","response":"Hello World"}')
+        client = make_transfluent()
         (
-            flexmock(requests)
+            flexmock(client.session)
             .should_receive('request')
             .with_args(
                 'GET',
@@ -63,14 +130,14 @@ class TestTransfluent(object):
             .and_return(response)
             .once()
         )
-        client = make_transfluent()
         response = client._request('GET', 'hello/World/')
         assert response == u'Hello World'
 
     def test_request_on_successful_non_json_response(self):
         response = make_response(b'some content')
+        client = make_transfluent()
         (
-            flexmock(requests)
+            flexmock(client.session)
             .should_receive('request')
             .with_args(
                 'GET',
@@ -80,15 +147,15 @@ class TestTransfluent(object):
             .and_return(response)
             .once()
         )
-        client = make_transfluent()
         response = client._request('GET', 'hello/World/')
         assert response == b'some content'
 
     def test_request_on_error_raises_exception(self):
         from transfluent import TransfluentError
         response = make_error_response()
+        client = make_transfluent()
         (
-            flexmock(requests)
+            flexmock(client.session)
             .should_receive('request')
             .with_args(
                 'GET',
@@ -98,13 +165,281 @@ class TestTransfluent(object):
             .and_return(response)
             .once()
         )
-        client = make_transfluent()
         with pytest.raises(TransfluentError) as excinfo:
             response = client._request('GET', 'hello/')
         exception = excinfo.value
         assert exception.type == 'EBackendParameterInvalid'
         assert exception.message == 'Name is required!'
 
+    def test_request_is_not_cached_by_default(self):
+        client = make_transfluent()
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":[]}'))
+            .twice()
+        )
+        client.languages
+        client.languages
+        assert client.cache is None
+
+    def test_cached_request(self):
+        client = make_transfluent(cache_ttl=60)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":[[1,"en-gb"]]}'))
+            .once()
+        )
+        assert client.languages == [[1, 'en-gb']]
+        assert client.languages == [[1, 'en-gb']]
+        assert client.cache.hits == 1
+        assert client.cache.misses == 1
+
+    def test_cached_request_is_keyed_by_token(self):
+        client = make_transfluent(token='foo', cache_ttl=60)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":"John"}'))
+            .twice()
+        )
+        client.customer_name
+        client.token = 'bar'
+        client.customer_name
+
+    def test_setter_invalidates_cached_request(self):
+        client = make_transfluent(token='foo', cache_ttl=60)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":"John"}'))
+            .times(3)
+        )
+        client.customer_name
+        client.customer_name = 'John'
+        client.customer_name
+        assert client.cache.hits == 0
+
+    def test_refresh_discards_cached_requests(self):
+        client = make_transfluent(cache_ttl=60)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":[]}'))
+            .twice()
+        )
+        client.languages
+        client.refresh()
+        client.languages
+
+
+    def test_request_retries_get_on_retryable_status(self):
+        from transfluent import RetryPolicy
+        client = make_transfluent(retry=RetryPolicy(total=2))
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{}', status_code=503))
+            .and_return(make_response(b'{"response":"OK"}'))
+            .twice()
+        )
+        flexmock(time).should_receive('sleep').once()
+        assert client._request('GET', 'hello/') == 'OK'
+
+    def test_request_retries_connection_errors(self):
+        from transfluent import RetryPolicy
+        client = make_transfluent(retry=RetryPolicy(total=2))
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_raise(requests.ConnectionError)
+            .and_return(make_response(b'{"response":"OK"}'))
+            .twice()
+        )
+        flexmock(time).should_receive('sleep').once()
+        assert client._request('GET', 'hello/') == 'OK'
+
+    def test_request_gives_up_after_total_retries(self):
+        from transfluent import RetryPolicy
+        client = make_transfluent(retry=RetryPolicy(total=2))
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_raise(requests.ConnectionError)
+            .times(3)
+        )
+        flexmock(time).should_receive('sleep').twice()
+        with pytest.raises(requests.ConnectionError):
+            client._request('GET', 'hello/')
+
+    def test_request_does_not_retry_post_by_default(self):
+        from transfluent import RetryPolicy, TransfluentError
+        client = make_transfluent(retry=RetryPolicy())
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_error_response())
+            .once()
+        )
+        with pytest.raises(TransfluentError):
+            client._request('POST', 'hello/')
+
+    def test_request_retries_post_when_enabled(self):
+        from transfluent import RetryPolicy
+        client = make_transfluent(retry=RetryPolicy(retry_post=True))
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{}', status_code=500))
+            .and_return(make_response(b'{"response":"OK"}'))
+            .twice()
+        )
+        flexmock(time).should_receive('sleep')
+        assert client._request('POST', 'hello/') == 'OK'
+
+    def test_request_does_not_retry_client_errors(self):
+        from transfluent import RetryPolicy, TransfluentError
+        client = make_transfluent(retry=RetryPolicy())
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_error_response())
+            .once()
+        )
+        with pytest.raises(TransfluentError):
+            client._request('GET', 'hello/')
+
+    def test_request_fails_fast_when_circuit_is_open(self):
+        from transfluent import CircuitBreaker, CircuitOpenError
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        client = make_transfluent(circuit_breaker=breaker)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_raise(requests.ConnectionError)
+            .twice()
+        )
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                client._request('GET', 'hello/')
+        with pytest.raises(CircuitOpenError):
+            client._request('GET', 'hello/')
+
+
+    def test_request_calls_hooks(self):
+        events = []
+        client = make_transfluent(hooks={
+            'before_send': [lambda info: events.append(('before', info))],
+            'after_response': [
+                lambda info, response: events.append(('after', info))
+            ],
+        })
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":"OK"}'))
+        )
+        client._request('POST', 'hello/', {'foo': 'bar'})
+        assert [event for event, _ in events] == ['before', 'after']
+        info = events[0][1]
+        assert info is events[1][1]
+        assert info.method == 'POST'
+        assert info.path == 'hello/'
+        assert info.url == 'https://transfluent.com/v2/hello/'
+        assert info.bytes_sent == len('foo=bar')
+        assert info.bytes_received == len(b'{"response":"OK"}')
+        assert info.status_code == 200
+        assert info.elapsed >= 0
+
+    def test_request_calls_error_hook(self):
+        errors = []
+        client = make_transfluent()
+        client.register_hook(
+            'on_error', lambda info, exc: errors.append((info, exc))
+        )
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_raise(requests.ConnectionError)
+        )
+        with pytest.raises(requests.ConnectionError):
+            client._request('GET', 'hello/')
+        info, exc = errors[0]
+        assert isinstance(exc, requests.ConnectionError)
+        assert info.status_code is None
+
+    def test_register_hook_with_unknown_event(self):
+        client = make_transfluent()
+        with pytest.raises(ValueError):
+            client.register_hook('foo', lambda info: None)
+
+
+    def test_request_compresses_large_post_bodies(self):
+        import zlib
+        client = make_transfluent(compress_requests='gzip',
+                                  compress_min_size=10)
+        sent = {}
+
+        def request(method, url, data, headers):
+            sent.update(data=data, headers=headers)
+            return make_response(b'{"response":"OK"}')
+
+        flexmock(client.session).should_receive('request').replace_with(
+            request
+        )
+        client._request('POST', 'texts', {'texts[foo]': 'bar' * 10})
+        assert sent['headers'] == {
+            'Content-Encoding': 'gzip',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        assert zlib.decompress(sent['data'], 31) == (
+            b'texts%5Bfoo%5D=' + b'bar' * 10
+        )
+
+    def test_request_does_not_compress_small_post_bodies(self):
+        client = make_transfluent(compress_requests='deflate')
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .with_args(
+                'POST',
+                'https://transfluent.com/v2/hello/',
+                data=b'foo=bar',
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            )
+            .and_return(make_response(b'{"response":"OK"}'))
+            .once()
+        )
+        client._request('POST', 'hello/', {'foo': 'bar'})
+
+    def test_request_compresses_streamed_bodies(self):
+        import zlib
+        from transfluent import RequestStats
+        client = make_transfluent(token='foo', compress_requests='deflate')
+        stats = RequestStats().install(client)
+        sent = {}
+
+        def request(method, url, data, headers):
+            sent.update(data=b''.join(data), headers=headers)
+            return make_response(b'{"response":"OK"}')
+
+        flexmock(client.session).should_receive('request').replace_with(
+            request
+        )
+        client.file_save_streaming('a', 1, BytesIO(b'x' * 3000), 'po-file')
+        assert sent['headers']['Content-Encoding'] == 'deflate'
+        body = zlib.decompress(sent['data'])
+        assert body.endswith(base64.b64encode(b'x' * 3000))
+        endpoint = stats.as_dict()['POST file/save']
+        assert endpoint['bytes_sent'] == len(sent['data'])
+        assert endpoint['bytes_sent_uncompressed'] == len(body)
+
+    def test_constructor_rejects_unknown_compression(self):
+        with pytest.raises(ValueError):
+            make_transfluent(compress_requests='br')
+
+
     def test_authed_request_without_parameters(self):
         client = make_transfluent(token='foo')
         fake_rv = flexmock()
@@ -132,8 +467,51 @@ class TestTransfluent(object):
             .and_return(fake_rv)
             .once()
         )
-        rv = client._authed_request('POST', 'customer/name/', {'name': 'John'})
+        data = {'name': 'John'}
+        rv = client._authed_request('POST', 'customer/name/', data)
         assert rv is fake_rv
+        assert data == {'name': 'John'}
+
+    def test_for_token_shares_transport_cache_and_hooks(self):
+        client = make_transfluent(token='foo', cache_ttl=60)
+        view = client.for_token('bar')
+        assert view.token == 'bar'
+        assert client.token == 'foo'
+        assert view.transport is client.transport
+        assert view.cache is client.cache
+        assert view.hooks is client.hooks
+        assert view.for_token('baz')._shared_with is client
+
+    def test_for_token_view_does_not_close_transport(self):
+        client = make_transfluent()
+        flexmock(client.transport).should_receive('close').once()
+        client.for_token('bar').close()
+        client.close()
+
+    def test_for_token_views_send_their_own_token(self):
+        import threading
+        client = make_transfluent(token='foo')
+        sent = []
+
+        def send(method, path, data=None, headers=None):
+            sent.append(data['token'])
+            return {}
+
+        flexmock(client).should_receive('_send').replace_with(send)
+        data = {'identifier': 'file', 'language': 11}
+        threads = [
+            threading.Thread(
+                target=client.for_token('token%d' % i)._authed_request,
+                args=('GET', 'file/status', data)
+            )
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(sent) == sorted('token%d' % i for i in range(8))
+        assert 'token' not in data
 
     def test_authenticate_sets_token(self):
         client = make_transfluent()
@@ -353,26 +731,35 @@ class TestTransfluent(object):
         assert rv is fake_rv
 
     def test_texts_save(self):
-        client = make_transfluent()
+        try:
+            from urllib.parse import parse_qsl
+        except ImportError:
+            from urlparse import parse_qsl
+        client = make_transfluent(token='x')
         fake_rv = flexmock()
+        sent = []
         (
             flexmock(client)
-            .should_receive('_authed_request')
-            .with_args(
-                'POST',
-                'texts',
-                {
-                    'group_id': 'my-project/messages',
-                    'language': 11,
-                    'texts[foo]': 'bar',
-                    'invalidate_translations': 1
-                }
+            .should_receive('_request')
+            .replace_with(
+                lambda method, path, data, headers:
+                sent.append((method, path, data, headers)) or fake_rv
             )
-            .and_return(fake_rv)
-            .once()
         )
         rv = client.texts_save('my-project/messages', 11, {'foo': 'bar'})
         assert rv is fake_rv
+        method, path, data, headers = sent[0]
+        assert (method, path) == ('POST', 'texts')
+        assert headers == {
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+        assert sorted(parse_qsl(data.decode('ascii'))) == [
+            ('group_id', 'my-project/messages'),
+            ('invalidate_translations', '1'),
+            ('language', '11'),
+            ('texts[foo]', 'bar'),
+            ('token', 'x'),
+        ]
 
     def test_texts_read(self):
         client = make_transfluent()
@@ -397,27 +784,20 @@ class TestTransfluent(object):
         assert rv is fake_rv
 
     def test_texts_translate(self):
-        client = make_transfluent()
+        try:
+            from urllib.parse import parse_qsl
+        except ImportError:
+            from urlparse import parse_qsl
+        client = make_transfluent(token='x')
         fake_rv = flexmock()
+        sent = []
         (
             flexmock(client)
-            .should_receive('_authed_request')
-            .with_args(
-                'GET',
-                'texts/translate',
-                {
-                    'group_id': 'my-project/messages',
-                    'source_language': 11,
-                    'target_languages[]': [1, 14],
-                    'texts[][id]': ['foo', 'bar'],
-                    'comment': '',
-                    'callback_url': '',
-                    'max_words': 1000,
-                    'level': 3
-                }
+            .should_receive('_request')
+            .replace_with(
+                lambda method, path, data:
+                sent.append((method, path, data)) or fake_rv
             )
-            .and_return(fake_rv)
-            .once()
         )
         rv = client.texts_translate(
             group_id='my-project/messages',
@@ -426,6 +806,1672 @@ class TestTransfluent(object):
             texts=['foo', 'bar']
         )
         assert rv is fake_rv
+        method, path, data = sent[0]
+        assert (method, path) == ('GET', 'texts/translate')
+        assert sorted(parse_qsl(data, keep_blank_values=True)) == [
+            ('callback_url', ''),
+            ('comment', ''),
+            ('group_id', 'my-project/messages'),
+            ('level', '3'),
+            ('max_words', '1000'),
+            ('source_language', '11'),
+            ('target_languages[]', '1'),
+            ('target_languages[]', '14'),
+            ('texts[][id]', 'bar'),
+            ('texts[][id]', 'foo'),
+            ('token', 'x'),
+        ]
+
+    def test_encode_form_matches_urlencode(self):
+        try:
+            from urllib.parse import urlencode
+        except ImportError:
+            from urllib import urlencode
+        from transfluent import encode_form
+        texts = {u'k\xe4y 1': u'\u2603 & =', 'b': 'plain'}
+        fields = [('a', 1), ('list[]', [1, 2]), ('skip', None)]
+        expected = urlencode(
+            [('a', 1), ('list[]', 1), ('list[]', 2)] +
+            [(u'texts[{0}]'.format(key).encode('utf-8'),
+              value.encode('utf-8'))
+             for key, value in texts.items()]
+        )
+        assert encode_form(fields, ('texts', texts)) == (
+            expected.encode('ascii')
+        )
+
+    def file_save_streaming_body(self, file, **kwargs):
+        try:
+            from urllib.parse import parse_qs
+        except ImportError:
+            from urlparse import parse_qs
+        client = make_transfluent(token='foo')
+        bodies = []
+
+        def request(method, url, data, headers):
+            assert method == 'POST'
+            assert url == 'https://transfluent.com/v2/file/save'
+            assert headers == {
+                'Content-Type': 'application/x-www-form-urlencoded'
+            }
+            bodies.append(b''.join(data))
+            return make_response(b'{"response":"OK"}')
+
+        flexmock(client.session).should_receive('request').replace_with(
+            request
+        )
+        rv = client.file_save_streaming(
+            'my-project/messages', 1, file, 'po-file', **kwargs
+        )
+        assert rv == 'OK'
+        return parse_qs(bodies[0].decode('ascii'))
+
+    def test_file_save_streaming_with_file_object(self):
+        content = bytes(bytearray(range(256))) * 3
+        body = self.file_save_streaming_body(BytesIO(content), chunk_size=7)
+        assert body == {
+            'token': ['foo'],
+            'identifier': ['my-project/messages'],
+            'language': ['1'],
+            'format': ['UTF-8'],
+            'type': ['po-file'],
+            'save_only_data': ['0'],
+            'content': [base64.b64encode(content).decode('ascii')],
+        }
+
+    def test_file_save_streaming_with_memoryview(self):
+        content = b'file contents'
+        body = self.file_save_streaming_body(
+            memoryview(content), chunk_size=4
+        )
+        assert body['content'] == ['ZmlsZSBjb250ZW50cw==']
+
+    def test_file_save_streaming_with_path(self, tmpdir):
+        path = tmpdir.join('messages.pot')
+        path.write_binary(b'file contents')
+        body = self.file_save_streaming_body(u'%s' % path, chunk_size=5)
+        assert body['content'] == ['ZmlsZSBjb250ZW50cw==']
+
+    def test_file_save_streaming_with_bytes(self):
+        body = self.file_save_streaming_body(b'file contents', chunk_size=5)
+        assert body['content'] == ['ZmlsZSBjb250ZW50cw==']
+
+    def test_file_save_streaming_with_text_file(self):
+        from io import StringIO
+        body = self.file_save_streaming_body(
+            StringIO(u'p\xe4iv\xe4\xe4'), chunk_size=2
+        )
+        expected = base64.b64encode(u'p\xe4iv\xe4\xe4'.encode('utf-8'))
+        assert body['content'] == [expected.decode('ascii')]
+
+
+    def test_texts_save_incremental_saves_only_changed_texts(self):
+        from transfluent import Manifest
+        client = make_transfluent()
+        manifest = Manifest(':memory:')
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .with_args('my-project/messages', 11, {'a': '1', 'b': '2'}, True)
+            .and_return('OK')
+            .once()
+        )
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .with_args('my-project/messages', 11, {'b': '3'}, True)
+            .and_return('OK')
+            .once()
+        )
+        client.texts_save_incremental(
+            'my-project/messages', 11, {'a': '1', 'b': '2'}, manifest
+        )
+        rv = client.texts_save_incremental(
+            'my-project/messages', 11, {'a': '1', 'b': '3'}, manifest
+        )
+        assert rv == {
+            'saved': ['b'],
+            'skipped': ['a'],
+            'removed': [],
+            'response': 'OK',
+        }
+
+    def test_texts_save_incremental_without_changes_makes_no_requests(self):
+        from transfluent import Manifest
+        client = make_transfluent()
+        manifest = Manifest(':memory:')
+        manifest.update('my-project/messages', 11, {
+            'a': hashlib.sha1(b'1').hexdigest()
+        })
+        flexmock(client).should_receive('texts_save').never()
+        rv = client.texts_save_incremental(
+            'my-project/messages', 11, {'a': '1'}, manifest
+        )
+        assert rv['skipped'] == ['a']
+        assert rv['response'] is None
+
+    def test_texts_save_incremental_does_not_update_manifest_on_error(self):
+        from transfluent import Manifest, TransfluentError
+        client = make_transfluent()
+        manifest = Manifest(':memory:')
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .and_raise(make_transfluent_error(make_error_response()))
+        )
+        with pytest.raises(TransfluentError):
+            client.texts_save_incremental(
+                'my-project/messages', 11, {'a': '1'}, manifest
+            )
+        assert manifest.hashes('my-project/messages', 11) == {}
+
+    def test_texts_save_incremental_deletes_removed_keys(self):
+        from transfluent import Manifest
+        client = make_transfluent()
+        manifest = Manifest(':memory:')
+        manifest.update('my-project/messages', 11, {
+            'a': hashlib.sha1(b'1').hexdigest(),
+            'b': hashlib.sha1(b'2').hexdigest(),
+        })
+        rv = client.texts_save_incremental(
+            'my-project/messages', 11, {'a': '1'}, manifest,
+            delete_removed=True
+        )
+        assert rv['removed'] == ['b']
+        assert list(manifest.hashes('my-project/messages', 11)) == ['a']
+
+
+    def test_texts_save_many_splits_by_batch_size(self):
+        client = make_transfluent()
+        texts = dict(('key%d' % i, 'text') for i in range(5))
+        saved = []
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .replace_with(
+                lambda group_id, language, batch, invalidate:
+                saved.append(batch) or len(batch)
+            )
+        )
+        results = client.texts_save_many(
+            'my-project/messages', 11, texts, batch_size=2
+        )
+        assert [len(r.texts) for r in results] == [2, 2, 1]
+        assert [r.response for r in results] == [2, 2, 1]
+        assert all(r.error is None for r in results)
+        merged = {}
+        for batch in saved:
+            merged.update(batch)
+        assert merged == texts
+
+    def test_texts_save_many_splits_by_batch_bytes(self):
+        client = make_transfluent()
+        texts = {'a': 'x' * 10, 'b': 'y' * 10, 'c': 'z' * 30}
+        flexmock(client).should_receive('texts_save').and_return('OK')
+        results = client.texts_save_many(
+            'my-project/messages', 11, texts, max_batch_bytes=25
+        )
+        assert [sorted(r.texts) for r in results] == [['a', 'b'], ['c']]
+
+    def test_texts_save_many_keeps_invalidate_translations(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .with_args('my-project/messages', 11, dict, False)
+            .and_return('OK')
+            .twice()
+        )
+        client.texts_save_many(
+            'my-project/messages', 11, {'a': '1', 'b': '2'},
+            invalidate_translations=False, batch_size=1
+        )
+
+    def test_texts_save_many_collects_errors(self):
+        client = make_transfluent()
+        error = make_transfluent_error(make_error_response())
+
+        def texts_save(group_id, language, batch, invalidate):
+            if 'b' in batch:
+                raise error
+            return 'OK'
+
+        flexmock(client).should_receive('texts_save').replace_with(texts_save)
+        results = client.texts_save_many(
+            'my-project/messages', 11, {'a': '1', 'b': '2'}, batch_size=1
+        )
+        by_key = dict((list(r.texts)[0], r) for r in results)
+        assert by_key['a'].response == 'OK'
+        assert by_key['a'].error is None
+        assert by_key['b'].response is None
+        assert by_key['b'].error is error
+
+    def test_texts_word_counts_counts_saved_texts(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('iter_texts')
+            .and_return(iter([{'id': 'a', 'text': 'one two'},
+                              {'id': 'b', 'text': 'three'}]))
+        )
+        assert client.texts_word_counts('my-project/messages', 1) == {
+            'a': 2, 'b': 1
+        }
+
+    def test_texts_translate_many_splits_by_max_words(self):
+        client = make_transfluent()
+        ordered = []
+
+        def texts_translate(group_id, language, targets, texts, **kwargs):
+            ordered.append(texts)
+            return {'word_count': len(texts)}
+
+        (
+            flexmock(client)
+            .should_receive('texts_translate')
+            .replace_with(texts_translate)
+        )
+        from collections import OrderedDict
+        texts = OrderedDict([
+            ('a', 'one two'), ('b', 'three four'), ('c', 'five')
+        ])
+        results = client.texts_translate_many(
+            'my-project/messages', 1, [11, 12], texts, max_words=8
+        )
+        assert [r.texts for r in results] == [['a', 'b'], ['c']]
+        assert sorted(ordered) == [['a', 'b'], ['c']]
+        assert all(r.error is None for r in results)
+
+    def test_texts_translate_many_reads_word_counts(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_word_counts')
+            .with_args('my-project/messages', 1, ['a', 'b'])
+            .and_return({'a': 600, 'b': 600})
+        )
+        (
+            flexmock(client)
+            .should_receive('texts_translate')
+            .and_return('OK')
+            .twice()
+        )
+        results = client.texts_translate_many(
+            'my-project/messages', 1, [11], ['a', 'b']
+        )
+        assert [r.texts for r in results] == [['a'], ['b']]
+
+    def test_texts_translate_many_keeps_text_order(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_word_counts')
+            .and_return({'b': 1, 2: 1, 'a': 1})
+        )
+        flexmock(client).should_receive('texts_translate').and_return('OK')
+        results = client.texts_translate_many(
+            'my-project/messages', 1, [11], ['b', 2, 'a'], max_words=2
+        )
+        assert [r.texts for r in results] == [['b', 2], ['a']]
+
+    def test_count_words(self):
+        from transfluent import count_words
+        assert count_words(u'Hello,  wide\nworld!') == 3
+        assert count_words(u'\u65e5\u672c\u8a9e text') == 4
+        assert count_words(b'two words') == 2
+        assert count_words(u'') == 0
+
+
+    def test_file_status_many(self):
+        client = make_transfluent()
+        error = make_transfluent_error(make_error_response())
+
+        def file_status(identifier, language):
+            assert identifier == 'my-project/messages'
+            if language == 14:
+                raise error
+            return {'progress': '{0}%'.format(language)}
+
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .replace_with(file_status)
+        )
+        statuses, errors = client.file_status_many(
+            'my-project/messages', [11, 14, 20]
+        )
+        assert statuses == {11: {'progress': '11%'}, 20: {'progress': '20%'}}
+        assert errors == {14: error}
+
+    def test_file_read_many(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('file_read')
+            .replace_with(lambda identifier, language: language * 2)
+        )
+        files, errors = client.file_read_many(
+            'my-project/messages', [11, 14], max_workers=2
+        )
+        assert files == {11: 22, 14: 28}
+        assert errors == {}
+
+
+    def test_wait_for_files_yields_pairs_as_they_complete(self):
+        client = make_transfluent()
+        progress = {
+            ('a', 11): iter(['100%']),
+            ('a', 14): iter(['10%', '50%', '100%']),
+        }
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .replace_with(
+                lambda identifier, language:
+                {'progress': next(progress[identifier, language])}
+            )
+        )
+        flexmock(client).should_receive('file_read').never()
+        pairs = client.wait_for_files(
+            [('a', 11), ('a', 14)], initial_delay=0.01
+        )
+        assert list(pairs) == [('a', 11), ('a', 14)]
+
+    def test_wait_for_files_reads_completed_files(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .and_return({'progress': '100%'})
+        )
+        (
+            flexmock(client)
+            .should_receive('file_read')
+            .with_args('a', 11)
+            .and_return('content')
+            .once()
+        )
+        pairs = client.wait_for_files([('a', 11)], read=True)
+        assert list(pairs) == [('a', 11, 'content')]
+
+    def test_wait_for_files_backs_off(self):
+        client = make_transfluent()
+        progress = iter(['0%', '0%', '0%', '100%'])
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .replace_with(lambda *args: {'progress': next(progress)})
+        )
+        flexmock(random).should_receive('uniform').and_return(1)
+        now = [0]
+        flexmock(time).should_receive('time').replace_with(lambda: now[0])
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        flexmock(time).should_receive('sleep').replace_with(sleep)
+        list(client.wait_for_files(
+            [('a', 11)], initial_delay=1, max_delay=3, backoff=2
+        ))
+        assert sleeps == [1, 2, 3]
+
+    def test_wait_for_files_raises_on_timeout(self):
+        from transfluent import TransfluentTimeout
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .and_return({'progress': '0%'})
+        )
+        with pytest.raises(TransfluentTimeout) as excinfo:
+            list(client.wait_for_files([('a', 11)], timeout=0))
+        assert excinfo.value.pending == [('a', 11)]
+
+    def test_wait_for_files_keeps_polling_when_a_file_fails(self):
+        from transfluent import TransfluentWaitError
+        client = make_transfluent()
+        error = make_transfluent_error(make_error_response())
+        progress = {('a', 14): iter(['10%', '100%'])}
+
+        def file_status(identifier, language):
+            if language == 11:
+                raise error
+            return {'progress': next(progress[identifier, language])}
+
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .replace_with(file_status)
+        )
+        pairs = client.wait_for_files(
+            [('a', 11), ('a', 14)], initial_delay=0.01
+        )
+        assert next(pairs) == ('a', 14)
+        with pytest.raises(TransfluentWaitError) as excinfo:
+            next(pairs)
+        assert excinfo.value.errors == {('a', 11): error}
+        assert excinfo.value.completed == [('a', 14)]
+        assert excinfo.value.pending == []
+
+    def test_texts_read_stream(self):
+        client = make_transfluent(token='foo')
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .with_args(
+                'GET',
+                'https://transfluent.com/v2/texts',
+                params={
+                    'group_id': 'my-project/messages',
+                    'language': 11,
+                    'limit': 100,
+                    'offset': 0,
+                    'token': 'foo',
+                },
+                stream=True
+            )
+            .and_return(make_response(
+                b'{"status":"OK","response":[{"id":"a"},{"id":"b"}]}'
+            ))
+            .once()
+        )
+        texts = client.texts_read_stream('my-project/messages', 11)
+        assert list(texts) == [{'id': 'a'}, {'id': 'b'}]
+
+    def test_file_read_to_writes_raw_body(self, tmpdir):
+        client = make_transfluent(token='foo')
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .with_args(
+                'GET',
+                'https://transfluent.com/v2/file/read',
+                params={
+                    'identifier': 'my-project/messages',
+                    'language': 11,
+                    'token': 'foo',
+                },
+                stream=True
+            )
+            .and_return(make_response(b'msgid "a"\nmsgstr "b"\n'))
+            .once()
+        )
+        path = tmpdir.join('messages.po')
+        path.write_binary(b'old')
+        size = client.file_read_to('my-project/messages', 11, str(path))
+        assert path.read_binary() == b'msgid "a"\nmsgstr "b"\n'
+        assert size == 21
+        assert tmpdir.listdir() == [path]
+
+    def test_file_read_to_decodes_json_string(self, tmpdir):
+        client = make_transfluent(token='foo')
+        response = make_response(
+            b'{"status":"OK","response":"msgid \\"\\u00e4\\"\\n"}'
+        )
+        response.headers['Content-Type'] = 'application/json'
+        flexmock(client.session).should_receive('request').and_return(
+            response
+        )
+        path = tmpdir.join('messages.po')
+        client.file_read_to('my-project/messages', 11, str(path))
+        assert path.read_binary() == u'msgid "\xe4"\n'.encode('utf-8')
+
+    def test_file_read_to_keeps_destination_on_error(self, tmpdir):
+        from transfluent import TransfluentError
+        client = make_transfluent(token='foo')
+        flexmock(client.session).should_receive('request').and_return(
+            make_error_response()
+        )
+        path = tmpdir.join('messages.po')
+        path.write_binary(b'old')
+        with pytest.raises(TransfluentError):
+            client.file_read_to('my-project/messages', 11, str(path))
+        assert path.read_binary() == b'old'
+        assert tmpdir.listdir() == [path]
+
+    def test_texts_read_stream_raises_on_error(self):
+        from transfluent import TransfluentError
+        client = make_transfluent(token='foo')
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_error_response())
+        )
+        with pytest.raises(TransfluentError):
+            list(client.texts_read_stream('my-project/messages', 11))
+
+
+    def test_iter_texts_reads_all_pages(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('my-project/messages', 11, 2, 0)
+            .and_return([{'id': 'a'}, {'id': 'b'}])
+            .once()
+        )
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('my-project/messages', 11, 2, 2)
+            .and_return([{'id': 'c'}])
+            .once()
+        )
+        texts = client.iter_texts('my-project/messages', 11, page_size=2)
+        assert list(texts) == [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+
+    def test_iter_texts_yields_items_of_dict_pages(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('my-project/messages', 11, 100, 0)
+            .and_return({'foo': 'bar'})
+            .once()
+        )
+        texts = client.iter_texts('my-project/messages', 11)
+        assert list(texts) == [('foo', 'bar')]
+
+    def test_iter_texts_stops_on_empty_page(self):
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('my-project/messages', 11, 1, 0)
+            .and_return(['a'])
+            .once()
+        )
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('my-project/messages', 11, 1, 1)
+            .and_return([])
+            .once()
+        )
+        texts = client.iter_texts('my-project/messages', 11, page_size=1)
+        assert list(texts) == ['a']
+
+
+def echo_app(environ, start_response):
+    import json
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    body = environ['wsgi.input'].read(length)
+    if environ['PATH_INFO'].endswith(('/gzip', '/deflate', '/rawdeflate')):
+        import zlib
+        content = b'{"response": "compressed"}'
+        encoding = environ['PATH_INFO'].rsplit('/', 1)[1]
+        wbits = {'gzip': 31, 'deflate': 15, 'rawdeflate': -15}[encoding]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+        content = compressor.compress(content) + compressor.flush()
+        start_response('200 OK', [
+            ('Content-Encoding', encoding.replace('raw', '')),
+            ('Content-Length', str(len(content))),
+            ('X-Accept-Encoding', environ.get('HTTP_ACCEPT_ENCODING', '')),
+        ])
+        return [content]
+    if environ['PATH_INFO'].endswith('/error'):
+        start_response('400 Bad Request', [
+            ('Content-Type', 'application/json')
+        ])
+        return [make_error_response().content]
+    content = json.dumps({'response': {
+        'method': environ['REQUEST_METHOD'],
+        'path': environ['PATH_INFO'],
+        'query': environ['QUERY_STRING'],
+        'body': body.decode('ascii'),
+        'content_type': environ.get('CONTENT_TYPE'),
+    }}).encode('utf-8')
+    start_response('200 OK', [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(content))),
+    ])
+    return [content]
+
+
+class TransportTests(object):
+    def test_get(self):
+        client = self.make_client()
+        rv = client._request('GET', 'echo', {'a': 1, 'b[]': [2, 3]})
+        assert rv['method'] == 'GET'
+        assert rv['path'] == '/v2/echo'
+        assert rv['query'] == 'a=1&b%5B%5D=2&b%5B%5D=3'
+
+    def test_post(self):
+        client = self.make_client()
+        rv = client._request('POST', 'echo', {'a': u'\xe4'})
+        assert rv['method'] == 'POST'
+        assert rv['body'] == 'a=%C3%A4'
+        assert rv['content_type'] == 'application/x-www-form-urlencoded'
+
+    def test_leaves_out_none_values(self):
+        client = self.make_client()
+        rv = client._request('GET', 'echo', {'a': 1, 'b': None,
+                                             'c': [None, 2]})
+        assert sorted(rv['query'].split('&')) == ['a=1', 'c=2']
+        rv = client._request('POST', 'echo', {'a': 1, 'b': None})
+        assert rv['body'] == 'a=1'
+        assert 'token' not in rv['query']
+
+    def test_error(self):
+        from transfluent import TransfluentError
+        client = self.make_client()
+        with pytest.raises(TransfluentError) as excinfo:
+            client._request('GET', 'error')
+        assert excinfo.value.type == 'EBackendParameterInvalid'
+        assert excinfo.value.response.status_code == 400
+
+    def test_streamed_response(self):
+        client = self.make_client()
+        items = list(client._request_items('GET', 'echo', {'a': 1}))
+        assert ('query', 'a=1') in items
+
+    def test_streamed_post(self):
+        client = self.make_client(token='foo')
+        rv = client.file_save_streaming('a', 1, BytesIO(b'abc'), 'po-file')
+        assert rv['body'].endswith('&content=YWJj')
+
+
+class TestWSGITransport(TransportTests):
+    def make_client(self, **kwargs):
+        from transfluent import WSGITransport
+        return make_transfluent(
+            url='http://fake/v2/', transport=WSGITransport(echo_app),
+            **kwargs
+        )
+
+
+class TestHTTPClientTransport(TransportTests):
+    @pytest.fixture(autouse=True)
+    def server(self):
+        from wsgiref.simple_server import WSGIRequestHandler, make_server
+        import threading
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        server = make_server('127.0.0.1', 0, chunked_app,
+                             handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{0}/v2/'.format(server.server_port)
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def make_client(self, **kwargs):
+        from transfluent import HTTPClientTransport
+        return make_transfluent(
+            url=self.url, transport=HTTPClientTransport(timeout=5),
+            **kwargs
+        )
+
+    @pytest.mark.parametrize('encoding', ['gzip', 'deflate', 'rawdeflate'])
+    def test_decompresses_responses(self, encoding):
+        client = self.make_client()
+        assert client._request('GET', encoding) == 'compressed'
+        items = list(client._request_items('GET', encoding))
+        assert items == ['compressed']
+
+    def test_counts_compressed_bytes_received(self):
+        from transfluent import RequestStats
+        client = self.make_client()
+        stats = RequestStats().install(client)
+        client._request('GET', 'gzip')
+        endpoint = stats.as_dict()['GET gzip']
+        assert endpoint['bytes_received'] == len(
+            b'{"response": "compressed"}'
+        )
+        assert 0 < endpoint['bytes_received_compressed']
+
+    def test_frames_streamed_body_chunks(self):
+        from transfluent import _encode_chunked
+        chunks = _encode_chunked([b'abc', b'', b'x' * 26])
+        assert b''.join(chunks) == (
+            b'3\r\nabc\r\n1A\r\n' + b'x' * 26 + b'\r\n0\r\n\r\n'
+        )
+
+    def test_reconnects_after_server_closes_connection(self):
+        client = self.make_client()
+        assert client._request('GET', 'echo')['method'] == 'GET'
+        assert client._request('GET', 'echo')['method'] == 'GET'
+        client.close()
+
+
+class KeepAliveServer(object):
+    """
+    Answers the first request on each connection with a keep-alive
+    response.  With `close_idle`, the connection is then closed right
+    away, otherwise the next request is read and left unanswered.
+    """
+
+    def __init__(self, close_idle=False):
+        import socket
+        import threading
+        self.close_idle = close_idle
+        self.requests = []
+        self.closed = threading.Event()
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.url = 'http://127.0.0.1:{0}/v2/'.format(
+            self.sock.getsockname()[1]
+        )
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        import socket
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except socket.error:
+                return
+            stream = connection.makefile('rb')
+            self.read_request(stream)
+            content = b'{"response": "ok"}'
+            connection.sendall(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(content)).encode('ascii') +
+                b'\r\n\r\n' + content
+            )
+            if not self.close_idle:
+                self.read_request(stream)
+            stream.close()
+            connection.close()
+            self.closed.set()
+
+    def read_request(self, stream):
+        request_line = stream.readline()
+        length = 0
+        for line in iter(stream.readline, b'\r\n'):
+            name, _, value = line.partition(b':')
+            if name.lower() == b'content-length':
+                length = int(value)
+        stream.read(length)
+        self.requests.append(request_line.split()[0].decode('ascii'))
+
+    def close(self):
+        self.sock.close()
+
+
+class TestHTTPClientTransportReuse(object):
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        self.closing = []
+        yield
+        for obj in self.closing:
+            obj.close()
+
+    def make_client(self, close_idle=False):
+        from transfluent import HTTPClientTransport
+        server = KeepAliveServer(close_idle)
+        client = make_transfluent(
+            url=server.url, transport=HTTPClientTransport(timeout=5)
+        )
+        self.closing.extend([client, server])
+        return client, server
+
+    def test_does_not_resend_post_after_it_was_sent(self):
+        from transfluent import _httplib
+        import socket
+        client, server = self.make_client()
+        assert client._request('POST', 'a', {'b': 1}) == 'ok'
+        with pytest.raises((socket.error, _httplib().HTTPException)):
+            client._request('POST', 'a', {'b': 1})
+        assert server.requests == ['POST', 'POST']
+
+    def test_resends_get_after_connection_is_lost(self):
+        client, server = self.make_client()
+        assert client._request('GET', 'a') == 'ok'
+        assert client._request('GET', 'a') == 'ok'
+        assert server.requests == ['GET', 'GET', 'GET']
+
+    def test_replaces_connection_closed_while_idle(self):
+        client, server = self.make_client(close_idle=True)
+        assert client._request('POST', 'a', {'b': 1}) == 'ok'
+        assert server.closed.wait(5)
+        assert client._request('POST', 'a', {'b': 1}) == 'ok'
+        assert server.requests == ['POST', 'POST']
+
+
+def chunked_app(environ, start_response):
+    # wsgiref does not decode chunked request bodies.
+    if environ.get('HTTP_TRANSFER_ENCODING') == 'chunked':
+        stream = environ['wsgi.input']
+        chunks = []
+        while True:
+            size = int(stream.readline(), 16)
+            chunks.append(stream.read(size))
+            stream.readline()
+            if not size:
+                break
+        body = b''.join(chunks)
+        environ['wsgi.input'] = BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return echo_app(environ, start_response)
+
+
+class TestIterJSONItems(object):
+    def items(self, content, key='response', chunk_size=1):
+        from transfluent import iter_json_items
+        chunks = [content[i:i + chunk_size]
+                  for i in range(0, len(content), chunk_size)]
+        return list(iter_json_items(chunks, key))
+
+    @pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1000])
+    def test_array(self, chunk_size):
+        content = (
+            u'{"status": "OK", "response": [{"id": "a", "text": "\xe4\u20ac"},'
+            u' 12345, -1.5e3, "x\\"y", [1, [2]], true, null]}'
+        ).encode('utf-8')
+        assert self.items(content, chunk_size=chunk_size) == [
+            {'id': 'a', 'text': u'\xe4\u20ac'}, 12345, -1500.0, 'x"y',
+            [1, [2]], True, None
+        ]
+
+    def test_object(self):
+        content = b'{"response": {"a": {"text": "1"}, "b": 2}, "status": "OK"}'
+        assert self.items(content) == [('a', {'text': '1'}), ('b', 2)]
+
+    def test_empty_array(self):
+        assert self.items(b'{"response": [ ]}') == []
+
+    def test_scalar(self):
+        assert self.items(b'{"response": "OK"}') == ['OK']
+
+    def test_missing_key(self):
+        assert self.items(b'{"status": "OK"}') == []
+
+    @pytest.mark.parametrize('chunk_size', [1, 2, 5, 13, 1000])
+    def test_file_body_json_string(self, chunk_size):
+        from transfluent import _iter_file_body
+        content = (
+            b'{"status": "OK", "response": "a\\"b\\\\c\\nd\\u00e4'
+            b'\\ud83d\\ude00\\/ \xe2\x82\xac end"}'
+        )
+        chunks = [content[i:i + chunk_size]
+                  for i in range(0, len(content), chunk_size)]
+        body = b''.join(_iter_file_body(chunks, 'application/json'))
+        assert body.decode('utf-8') == (
+            u'a"b\\c\nd\xe4\U0001f600/ \u20ac end'
+        )
+
+    def test_file_body_raw(self):
+        from transfluent import _iter_file_body
+        chunks = [b'', b'{"not": "an envelope"}']
+        assert list(_iter_file_body(chunks, 'application/octet-stream')) == [
+            b'{"not": "an envelope"}'
+        ]
+
+    def test_file_body_raw_keeps_leading_whitespace(self):
+        from transfluent import _iter_file_body
+        chunks = [b'\n', b' ', b'msgid ""\n', b'msgstr ""\n']
+        body = b''.join(_iter_file_body(chunks, 'text/plain'))
+        assert body == b'\n msgid ""\nmsgstr ""\n'
+
+    def test_file_body_json_after_whitespace(self):
+        from transfluent import _iter_file_body
+        chunks = [b'\n', b'{"response": "abc"}']
+        assert b''.join(_iter_file_body(chunks, None)) == b'abc'
+
+    def test_file_body_unterminated_string(self):
+        from transfluent import _iter_file_body
+        with pytest.raises(ValueError):
+            list(_iter_file_body([b'{"response": "abc'], None))
+
+    def test_invalid_json(self):
+        with pytest.raises(ValueError):
+            self.items(b'{"response": [1, 2')
+
+    def test_large_value(self):
+        text = 'x' * 100000
+        content = '{{"response": ["{0}", 1]}}'.format(text).encode('ascii')
+        assert self.items(content, chunk_size=10) == [text, 1]
+
+
+class TestRetryPolicy(object):
+    def make_policy(self, **kwargs):
+        from transfluent import RetryPolicy
+        return RetryPolicy(**kwargs)
+
+    def test_backoff_is_capped_full_jitter(self):
+        policy = self.make_policy(backoff_factor=1, max_backoff=5)
+        (
+            flexmock(random)
+            .should_receive('uniform')
+            .with_args(0, 5)
+            .and_return(4)
+            .once()
+        )
+        assert policy.get_backoff(10) == 4
+
+    def test_backoff_respects_retry_after_seconds(self):
+        policy = self.make_policy()
+        response = make_response(b'', status_code=429)
+        response.headers['Retry-After'] = '7'
+        assert policy.get_backoff(0, response) == 7
+
+    def test_backoff_respects_retry_after_date(self):
+        policy = self.make_policy()
+        response = make_response(b'', status_code=503)
+        response.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        assert policy.get_backoff(0, response) == 0
+
+    def test_backoff_ignores_retry_after_when_disabled(self):
+        policy = self.make_policy(respect_retry_after=False)
+        response = make_response(b'', status_code=429)
+        response.headers['Retry-After'] = '7'
+        assert policy.get_backoff(0, response) < 7
+
+
+class TestCircuitBreaker(object):
+    def make_breaker(self, **kwargs):
+        from transfluent import CircuitBreaker
+        self.now = 0
+        return CircuitBreaker(timer=lambda: self.now, **kwargs)
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = self.make_breaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert not breaker.is_open
+        breaker.record_failure()
+        assert breaker.is_open
+
+    def test_allows_one_trial_request_after_reset_timeout(self):
+        from transfluent import CircuitOpenError
+        breaker = self.make_breaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenError) as excinfo:
+            breaker.before_request()
+        assert excinfo.value.retry_after == 10
+        self.now = 10
+        breaker.before_request()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+        assert not breaker.is_open
+        breaker.before_request()
+
+    def test_failed_trial_request_reopens_circuit(self):
+        from transfluent import CircuitOpenError
+        breaker = self.make_breaker(failure_threshold=3, reset_timeout=10)
+        for _ in range(3):
+            breaker.record_failure()
+        self.now = 10
+        breaker.before_request()
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+
+class TestRequestStats(object):
+    def make_client(self, *responses):
+        from transfluent import RequestStats
+        client = make_transfluent(token='foo')
+        stats = RequestStats(buckets=(1, 10)).install(client)
+        responses = list(responses)
+
+        def request(method, url, params=None, data=None, headers=None):
+            if data is not None and not isinstance(data, dict):
+                b''.join(data)
+            return responses.pop(0)
+
+        flexmock(client.session).should_receive('request').replace_with(
+            request
+        )
+        return client, stats
+
+    def test_as_dict(self):
+        client, stats = self.make_client(
+            make_response(b'{"response":"OK"}'),
+            make_error_response()
+        )
+        client.file_status('a', 11)
+        with pytest.raises(Exception):
+            client.file_status('a', 11)
+        endpoint = stats.as_dict()['GET file/status']
+        assert endpoint['requests'] == 2
+        assert endpoint['retries'] == 0
+        assert endpoint['status_codes'] == {200: 1, 400: 1}
+        assert endpoint['errors'] == {'EBackendParameterInvalid': 1}
+        assert endpoint['bytes_sent'] == 2 * len(
+            'identifier=a&language=11&token=foo'
+        )
+        assert endpoint['bytes_received'] == (
+            len(b'{"response":"OK"}') + len(make_error_response().content)
+        )
+        assert endpoint['latency']['count'] == 2
+        assert endpoint['latency']['buckets'] == {'1': 2, '10': 0, '+Inf': 0}
+
+    def test_counts_retries_and_exceptions(self):
+        from transfluent import RetryPolicy, RequestStats
+        client = make_transfluent(retry=RetryPolicy(total=1))
+        stats = RequestStats().install(client)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_raise(requests.ConnectionError)
+            .and_return(make_response(b'{"response":[]}'))
+        )
+        flexmock(time).should_receive('sleep')
+        client.languages
+        endpoint = stats.as_dict()['GET languages']
+        assert endpoint['requests'] == 2
+        assert endpoint['retries'] == 1
+        assert endpoint['errors'] == {'ConnectionError': 1}
+
+    def test_counts_bytes_of_streamed_requests(self):
+        client, stats = self.make_client(make_response(b'{"response":1}'))
+        client.file_save_streaming('a', 1, BytesIO(b'abc'), 'po-file')
+        endpoint = stats.as_dict()['POST file/save']
+        assert endpoint['bytes_sent'] == len(
+            'token=foo&identifier=a&language=1&format=UTF-8&type=po-file&'
+            'save_only_data=0&content=YWJj'
+        )
+
+
+class TestOpenTelemetryHooks(object):
+    def test_records_spans(self):
+        from transfluent import OpenTelemetryHooks
+        spans = []
+
+        class FakeSpan(object):
+            def __init__(self, name):
+                self.name = name
+                self.attributes = {}
+                self.ended = False
+                spans.append(self)
+
+            def set_attribute(self, key, value):
+                self.attributes[key] = value
+
+            def end(self):
+                self.ended = True
+
+        tracer = flexmock(start_span=FakeSpan)
+        client = make_transfluent()
+        OpenTelemetryHooks(tracer).install(client)
+        (
+            flexmock(client.session)
+            .should_receive('request')
+            .and_return(make_response(b'{"response":[]}'))
+        )
+        client.languages
+        span, = spans
+        assert span.name == 'Transfluent GET languages'
+        assert span.attributes['http.status_code'] == 200
+        assert span.ended
+
+
+class TestTTLCache(object):
+    def make_cache(self, **kwargs):
+        from transfluent import TTLCache
+        self.now = 0
+        return TTLCache(timer=lambda: self.now, **kwargs)
+
+    def test_get_missing_key(self):
+        cache = self.make_cache(ttl=10)
+        assert cache.get('foo') == (False, None)
+        assert cache.misses == 1
+
+    def test_get_fresh_key(self):
+        cache = self.make_cache(ttl=10)
+        cache.set('foo', 'bar')
+        self.now = 9
+        assert cache.get('foo') == (True, 'bar')
+        assert cache.hits == 1
+
+    def test_get_expired_key(self):
+        cache = self.make_cache(ttl=10)
+        cache.set('foo', 'bar')
+        self.now = 10
+        assert cache.get('foo') == (False, None)
+        assert len(cache) == 0
+
+    def test_set_evicts_least_recently_used_key(self):
+        cache = self.make_cache(ttl=10, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') == (False, None)
+        assert cache.get('a') == (True, 1)
+        assert cache.get('c') == (True, 3)
+
+    def test_invalidate(self):
+        cache = self.make_cache(ttl=10)
+        cache.set(('a', 1), 1)
+        cache.set(('b', 1), 2)
+        cache.invalidate(lambda key: key[0] == 'a')
+        assert cache.get(('a', 1)) == (False, None)
+        assert cache.get(('b', 1)) == (True, 2)
+
+
+class TestRequestCoalescer(object):
+    def make_coalescer(self):
+        from transfluent import RequestCoalescer
+        return RequestCoalescer()
+
+    def run_concurrently(self, coalescer, key, func, count):
+        import threading
+        results = []
+
+        def call():
+            try:
+                results.append(coalescer.do(key, func))
+            except Exception as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_until(self, predicate):
+        deadline = time.time() + 5
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_concurrent_calls_share_one_call(self):
+        import threading
+        coalescer = self.make_coalescer()
+        release = threading.Event()
+        made = []
+
+        def func():
+            made.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, results = self.run_concurrently(coalescer, 'key', func, 5)
+        self.wait_until(lambda: coalescer.coalesced == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == ['result'] * 5
+        assert made == [1]
+        assert (coalescer.calls, coalescer.coalesced) == (1, 4)
+
+    def test_concurrent_calls_share_error(self):
+        import threading
+        coalescer = self.make_coalescer()
+        release = threading.Event()
+        error = ValueError('boom')
+
+        def func():
+            release.wait(5)
+            raise error
+
+        threads, results = self.run_concurrently(coalescer, 'key', func, 3)
+        self.wait_until(lambda: coalescer.coalesced == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == [error] * 3
+
+    def test_sequential_calls_are_not_coalesced(self):
+        coalescer = self.make_coalescer()
+        assert coalescer.do('key', lambda: 1) == 1
+        assert coalescer.do('key', lambda: 2) == 2
+        assert (coalescer.calls, coalescer.coalesced) == (2, 0)
+
+    def test_client_coalesces_idempotent_gets_only(self):
+        coalescer = self.make_coalescer()
+        client = make_transfluent(token='foo', coalescer=coalescer)
+        flexmock(client).should_receive('_send').and_return({})
+        client.file_status('file', 11)
+        client.texts_translate('group', 1, [11], ['a'])
+        client._request('POST', 'customer/name', {'name': 'x'})
+        assert coalescer.calls == 1
+
+
+class TestDownloadCache(object):
+    def make_cache(self, tmpdir):
+        from transfluent import DownloadCache
+        return DownloadCache(str(tmpdir.join('cache')))
+
+    def test_roundtrips_content_types(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        cache.set('file', 'a', 11, b'binary')
+        cache.set('file', 'b', 11, u'text \xe4')
+        cache.set('texts', 'c', 11, [{'id': 'x', 'text': 'y'}])
+        cache.set('file', 'd', 11, b'')
+        assert cache.get('file', 'a', 11)[:] == b'binary'
+        assert cache.get('file', 'b', 11) == u'text \xe4'
+        assert cache.get('texts', 'c', 11) == [{'id': 'x', 'text': 'y'}]
+        assert cache.get('file', 'd', 11) == b''
+        assert cache.get('file', 'a', 12) is None
+
+    def test_binary_content_is_memory_mapped(self, tmpdir):
+        import mmap
+        cache = self.make_cache(tmpdir)
+        cache.set('file', 'a', 11, b'binary')
+        content = cache.get('file', 'a', 11)
+        assert isinstance(content, mmap.mmap)
+        assert len(content) == 6
+        content.close()
+
+    def test_persists_and_removes_replaced_content(self, tmpdir):
+        from transfluent import DownloadCache
+        cache = self.make_cache(tmpdir)
+        cache.set('file', 'a', 11, b'old', 'status')
+        cache.set('file', 'b', 11, b'old')
+        cache.set('file', 'a', 11, b'new', 'status')
+        cache.set('file', 'b', 11, b'newer')
+        cache.close()
+        cache = DownloadCache(str(tmpdir.join('cache')))
+        assert cache.get('file', 'a', 11)[:] == b'new'
+        assert cache.entry('file', 'a', 11)[1] == 'status'
+        blobs = [p for p in tmpdir.join('cache').visit()
+                 if p.isfile() and p.basename != 'index.sqlite']
+        assert len(blobs) == 2
+        cache.remove('file', 'a', 11)
+        assert cache.get('file', 'a', 11) is None
+
+    def test_file_read_cached_skips_unchanged_files(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .and_return({'progress': '100%'})
+        )
+        (
+            flexmock(client)
+            .should_receive('file_read')
+            .and_return(b'content')
+            .once()
+        )
+        assert client.file_read_cached('file', 11, cache) == b'content'
+        assert client.file_read_cached('file', 11, cache)[:] == b'content'
+
+    def test_file_read_cached_downloads_changed_files(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        client = make_transfluent()
+        statuses = iter([{'progress': '50%'}, {'progress': '100%'}])
+        (
+            flexmock(client)
+            .should_receive('file_status')
+            .replace_with(lambda identifier, language: next(statuses))
+        )
+        contents = iter([b'half', b'done'])
+        (
+            flexmock(client)
+            .should_receive('file_read')
+            .replace_with(lambda identifier, language: next(contents))
+        )
+        assert client.file_read_cached('file', 11, cache) == b'half'
+        assert client.file_read_cached('file', 11, cache) == b'done'
+
+    def test_texts_read_cached_expires_after_max_age(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        client = make_transfluent()
+        (
+            flexmock(client)
+            .should_receive('texts_read')
+            .with_args('group', 11, 100, 0)
+            .and_return([{'id': 'a', 'text': 'b'}])
+            .twice()
+        )
+        now = time.time()
+        flexmock(time).should_receive('time').and_return(now)
+        client.texts_read_cached('group', 11, cache, max_age=60)
+        assert client.texts_read_cached('group', 11, cache, max_age=60) == [
+            {'id': 'a', 'text': 'b'}
+        ]
+        flexmock(time).should_receive('time').and_return(now + 61)
+        client.texts_read_cached('group', 11, cache, max_age=60)
+
+
+class TestWriteBehindQueue(object):
+    def make_queue(self, tmpdir, client, **kwargs):
+        from transfluent import WriteBehindQueue
+        kwargs.setdefault('start', False)
+        return WriteBehindQueue(
+            client, str(tmpdir.join('journal.sqlite')), **kwargs
+        )
+
+    def make_client(self, saved):
+        client = make_transfluent(token='x')
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .replace_with(
+                lambda group_id, language, texts, invalidate:
+                saved.append((group_id, language, texts, invalidate))
+            )
+        )
+        return client
+
+    def test_coalesces_writes_into_one_request(self, tmpdir):
+        saved = []
+        queue = self.make_queue(tmpdir, self.make_client(saved))
+        queue.texts_save('group', 1, {'a': 'old', 'b': 'b'}, False)
+        queue.texts_save('group', 1, {'a': 'new'}, False)
+        assert queue.pending == 2
+        assert queue.flush() == []
+        assert saved == [('group', '1', {'a': 'new', 'b': 'b'}, False)]
+        assert queue.pending == 0
+        queue.close()
+
+    def test_invalidation_of_coalesced_writes_is_kept(self, tmpdir):
+        saved = []
+        queue = self.make_queue(tmpdir, self.make_client(saved))
+        queue.texts_save('group', 1, {'a': 'old'}, True)
+        queue.texts_save('group', 1, {'a': 'new'}, False)
+        queue.close()
+        assert saved == [('group', '1', {'a': 'new'}, True)]
+
+    def test_failed_writes_are_replayed_after_restart(self, tmpdir):
+        client = make_transfluent(token='x')
+        (
+            flexmock(client)
+            .should_receive('texts_save')
+            .and_raise(requests.ConnectionError)
+        )
+        queue = self.make_queue(tmpdir, client)
+        queue.texts_save('group', 1, {'a': 'text'})
+        errors = queue.flush()
+        assert len(errors) == 1
+        assert isinstance(queue.last_error, requests.ConnectionError)
+        queue.close(flush=False)
+
+        saved = []
+        queue = self.make_queue(tmpdir, self.make_client(saved))
+        assert queue.pending == 1
+        queue.close()
+        assert saved == [('group', '1', {'a': 'text'}, True)]
+
+    def test_writes_made_during_flush_are_kept(self, tmpdir):
+        client = make_transfluent(token='x')
+        queue = self.make_queue(tmpdir, client)
+        saved = []
+
+        def texts_save(group_id, language, texts, invalidate):
+            saved.append(texts)
+            if len(saved) == 1:
+                queue.texts_save('group', 1, {'a': 'newer'})
+
+        flexmock(client).should_receive('texts_save').replace_with(
+            texts_save
+        )
+        queue.texts_save('group', 1, {'a': 'new'})
+        queue.flush()
+        assert queue.pending == 1
+        queue.flush()
+        assert saved == [{'a': 'new'}, {'a': 'newer'}]
+        assert queue.pending == 0
+        queue.close()
+
+    def test_saves_files(self, tmpdir):
+        client = make_transfluent(token='x')
+        saved = []
+        (
+            flexmock(client)
+            .should_receive('file_save')
+            .replace_with(
+                lambda identifier, language, file, type, format, data_only:
+                saved.append((identifier, language, file.read(), type))
+            )
+        )
+        queue = self.make_queue(tmpdir, client)
+        queue.file_save('messages', 11, BytesIO(b'old'), 'po-file')
+        queue.file_save('messages', 11, BytesIO(b'new'), 'po-file')
+        queue.close()
+        assert saved == [('messages', '11', b'new', 'po-file')]
+
+    def test_background_thread_flushes(self, tmpdir):
+        saved = []
+        queue = self.make_queue(tmpdir, self.make_client(saved), start=True,
+                                flush_interval=0.01)
+        queue.texts_save('group', 1, {'a': 'text'})
+        deadline = time.time() + 5
+        while queue.pending and time.time() < deadline:
+            time.sleep(0.01)
+        assert saved == [('group', '1', {'a': 'text'}, True)]
+        queue.close()
+
+
+class TestCallbackListener(object):
+    def make_listener(self, **kwargs):
+        from transfluent import CallbackListener
+        return CallbackListener(**kwargs)
+
+    def test_public_url_defaults_to_address(self):
+        with self.make_listener() as listener:
+            host, port = listener.address
+            assert listener.public_url == 'http://127.0.0.1:{0}'.format(port)
+
+    def test_expect_creates_unique_urls(self):
+        with self.make_listener(public_url='https://example.com/cb/') as cb:
+            first = cb.expect()
+            second = cb.expect()
+            assert first.url.startswith('https://example.com/cb/')
+            assert first.url != second.url
+            assert set(cb.pending) == set([first, second])
+
+    def test_callback_resolves_order(self):
+        with self.make_listener() as listener:
+            order = listener.expect()
+            called = []
+            order.add_done_callback(called.append)
+            response = requests.get(order.url, params={'status': 'ok'})
+            assert response.status_code == 200
+            assert order.wait(timeout=5) == {'status': 'ok'}
+            assert order.done
+            assert called == [order]
+            assert listener.pending == []
+
+    def test_unknown_callback_returns_not_found(self):
+        with self.make_listener() as listener:
+            order = listener.expect()
+            response = requests.get(listener.public_url + '/unknown')
+            assert response.status_code == 404
+            assert not order.done
+
+    def test_wait_raises_on_timeout(self):
+        from transfluent import TransfluentTimeout
+        with self.make_listener() as listener:
+            order = listener.expect()
+            with pytest.raises(TransfluentTimeout):
+                order.wait(timeout=0.01)
+
+
+class TestSync(object):
+    def make_tree(self, tmpdir):
+        tmpdir.ensure('app/messages.pot').write_binary(b'msgid "Hello"\n')
+        tmpdir.ensure('lib/errors.pot').write_binary(b'msgid "Oops"\n')
+        tmpdir.ensure('README.txt').write_binary(b'not a catalog')
+        return tmpdir
+
+    def make_client(self, uploaded):
+        client = make_transfluent(token='x')
+
+        def file_save(identifier, language, file, type):
+            uploaded.append((identifier, file.read()))
+
+        def wait_for_files(pairs, **kwargs):
+            for identifier, language in sorted(pairs):
+                yield identifier, language, u'msgstr "{0}"'.format(language)
+
+        flexmock(client).should_receive('file_save').replace_with(file_save)
+        flexmock(client).should_receive('file_translate')
+        flexmock(client).should_receive('wait_for_files').replace_with(
+            wait_for_files
+        )
+        return client
+
+    def test_uploads_files_and_writes_translations(self, tmpdir):
+        from transfluent import sync
+        tree = self.make_tree(tmpdir)
+        uploaded = []
+        rv = sync(self.make_client(uploaded), str(tree), 1, {11: 'fi'},
+                  identifier_prefix='proj/')
+        assert sorted(uploaded) == [
+            ('proj/app/messages', b'msgid "Hello"\n'),
+            ('proj/lib/errors', b'msgid "Oops"\n'),
+        ]
+        assert sorted(rv['written']) == [
+            'app/fi/LC_MESSAGES/messages.po'.replace('/', os.sep),
+            'lib/fi/LC_MESSAGES/errors.po'.replace('/', os.sep),
+        ]
+        assert rv['errors'] == {}
+        assert tree.join('app/fi/LC_MESSAGES/messages.po').read_binary() == (
+            b'msgstr "11"'
+        )
+
+    def test_skips_unchanged_files(self, tmpdir):
+        from transfluent import Manifest, sync
+        tree = self.make_tree(tmpdir)
+        manifest = Manifest(':memory:')
+        sync(self.make_client([]), str(tree), 1, {11: 'fi'},
+             manifest=manifest)
+        tree.join('lib/errors.pot').write_binary(b'msgid "Oops!"\n')
+        uploaded = []
+        rv = sync(self.make_client(uploaded), str(tree), 1, {11: 'fi'},
+                  manifest=manifest)
+        assert [identifier for identifier, _ in uploaded] == ['lib/errors']
+        assert rv['skipped'] == ['app/messages.pot'.replace('/', os.sep)]
+        assert rv['written'] == [
+            'lib/fi/LC_MESSAGES/errors.po'.replace('/', os.sep)
+        ]
+
+    def test_failed_uploads_are_reported_and_not_recorded(self, tmpdir):
+        from transfluent import Manifest, sync
+        tree = self.make_tree(tmpdir)
+        manifest = Manifest(':memory:')
+        client = make_transfluent(token='x')
+        (
+            flexmock(client)
+            .should_receive('file_save')
+            .and_raise(requests.ConnectionError)
+        )
+        flexmock(client).should_receive('wait_for_files').and_return([])
+        rv = sync(client, str(tree), 1, {11: 'fi'}, manifest=manifest)
+        assert rv['uploaded'] == []
+        assert len(rv['errors']) == 2
+        assert manifest.file_hashes(1) == {}
+        assert manifest.pending_files() == []
+
+    def test_pulls_pending_translations_on_next_sync(self, tmpdir):
+        from transfluent import Manifest, sync
+        tree = self.make_tree(tmpdir)
+        manifest = Manifest(':memory:')
+        rv = sync(self.make_client([]), str(tree), 1, {11: 'fi'},
+                  manifest=manifest, wait=False)
+        assert rv['written'] == []
+        uploaded = []
+        rv = sync(self.make_client(uploaded), str(tree), 1, {11: 'fi'},
+                  manifest=manifest)
+        assert uploaded == []
+        assert sorted(rv['written']) == [
+            'app/fi/LC_MESSAGES/messages.po'.replace('/', os.sep),
+            'lib/fi/LC_MESSAGES/errors.po'.replace('/', os.sep),
+        ]
+        assert manifest.pending_files() == []
+
+    def test_failed_downloads_are_reported_and_kept_pending(self, tmpdir):
+        from transfluent import Manifest, TransfluentWaitError, sync
+        tree = self.make_tree(tmpdir)
+        manifest = Manifest(':memory:')
+        client = self.make_client([])
+        error = requests.ConnectionError()
+
+        def wait_for_files(pairs, **kwargs):
+            yield 'app/messages', 11, u'msgstr ""'
+            raise TransfluentWaitError({('lib/errors', 11): error},
+                                       [('app/messages', 11)])
+
+        flexmock(client).should_receive('wait_for_files').replace_with(
+            wait_for_files
+        )
+        rv = sync(client, str(tree), 1, {11: 'fi'}, manifest=manifest)
+        assert rv['written'] == [
+            'app/fi/LC_MESSAGES/messages.po'.replace('/', os.sep)
+        ]
+        assert rv['errors'] == {
+            'lib/errors.pot (fi)'.replace('/', os.sep): error
+        }
+        assert manifest.pending_files() == [('lib/errors', '11')]
+
+    def test_file_hashes_do_not_collide_with_groups(self, tmpdir):
+        from transfluent import Manifest, sync
+        tree = self.make_tree(tmpdir)
+        manifest = Manifest(':memory:')
+        manifest.update('files', 1, {'app/messages': 'stale'})
+        uploaded = []
+        sync(self.make_client(uploaded), str(tree), 1, {11: 'fi'},
+             manifest=manifest)
+        assert len(uploaded) == 2
+        assert manifest.hashes('files', 1) == {'app/messages': 'stale'}
+
+    def test_does_not_upload_its_own_translations(self, tmpdir):
+        from transfluent import sync
+        tmpdir.ensure('app/messages.po').write_binary(b'msgid "Hello"\n')
+        for _ in range(2):
+            uploaded = []
+            rv = sync(self.make_client(uploaded), str(tmpdir), 1,
+                      {11: 'fi', 14: 'sv'}, patterns=['*.po'])
+            assert [identifier for identifier, _ in uploaded] == [
+                'app/messages'
+            ]
+            assert sorted(rv['written']) == [
+                'app/fi/LC_MESSAGES/messages.po'.replace('/', os.sep),
+                'app/sv/LC_MESSAGES/messages.po'.replace('/', os.sep),
+            ]
+
+    def test_main_requires_token(self, tmpdir, monkeypatch):
+        from transfluent import main
+        monkeypatch.delenv('TRANSFLUENT_TOKEN', raising=False)
+        with pytest.raises(SystemExit):
+            main(['sync', str(tmpdir), '--target', '11:fi'])
+
+
+class TestAtomicWrite(object):
+    def test_replaces_file(self, tmpdir):
+        from transfluent import _atomic_write
+        path = tmpdir.join('out.po')
+        path.write_binary(b'old')
+        _atomic_write(str(path), [b'new ', b'content'])
+        assert path.read_binary() == b'new content'
+        assert tmpdir.listdir() == [path]
+
+    @pytest.mark.skipif(os.name != 'posix', reason='POSIX permissions')
+    def test_keeps_mode_of_replaced_file(self, tmpdir):
+        from transfluent import _atomic_write
+        path = tmpdir.join('out.po')
+        path.write_binary(b'old')
+        path.chmod(0o640)
+        _atomic_write(str(path), [b'new'])
+        assert path.stat().mode & 0o777 == 0o640
+
+    @pytest.mark.skipif(os.name != 'posix', reason='POSIX permissions')
+    def test_new_file_mode_follows_umask(self, tmpdir):
+        from transfluent import _atomic_write, _umask
+        path = tmpdir.join('out.po')
+        _atomic_write(str(path), [b'new'])
+        assert path.stat().mode & 0o777 == 0o666 & ~_umask()
+
+    def test_keeps_original_on_error(self, tmpdir):
+        from transfluent import _atomic_write
+        path = tmpdir.join('out.po')
+        path.write_binary(b'old')
+
+        def chunks():
+            yield b'partial'
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            _atomic_write(str(path), chunks())
+        assert path.read_binary() == b'old'
+        assert tmpdir.listdir() == [path]
 
 
 class TestTransfluentError(object):
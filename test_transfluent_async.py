@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+
+def make_async_transfluent(*args, **kwargs):
+    from transfluent_async import AsyncTransfluent
+    return AsyncTransfluent(*args, **kwargs)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeResponse(object):
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def read(self):
+        return self.content
+
+
+class FakeSession(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+class TestAsyncTransfluent(object):
+
+    def test_constructor_sets_token(self):
+        client = make_async_transfluent(token='foo')
+        assert client.token == 'foo'
+
+    def test_request_on_successful_json_response(self):
+        session = FakeSession(
+            FakeResponse(b'{"status":"OK","response":"Hello World"}')
+        )
+        client = make_async_transfluent(session=session)
+        assert run(client._request('GET', 'hello/World/')) == u'Hello World'
+        assert session.requests == [
+            ('GET', 'https://transfluent.com/v2/hello/World/', {'params': []})
+        ]
+
+    def test_request_on_successful_non_json_response(self):
+        session = FakeSession(FakeResponse(b'some content'))
+        client = make_async_transfluent(session=session)
+        assert run(client._request('GET', 'hello/')) == b'some content'
+
+    def test_request_on_error_raises_exception(self):
+        from transfluent import TransfluentError
+        session = FakeSession(FakeResponse(
+            b'{"status":"ERROR","error":{"type":"EBackendParameterInvalid",'
+            b'"message":"Name is required!"},"response":"Error"}',
+            status=400
+        ))
+        client = make_async_transfluent(session=session)
+        with pytest.raises(TransfluentError) as excinfo:
+            run(client._request('GET', 'hello/'))
+        assert excinfo.value.type == 'EBackendParameterInvalid'
+        assert excinfo.value.message == 'Name is required!'
+
+    def test_request_flattens_list_values(self):
+        session = FakeSession(FakeResponse(b'{"response":{}}'))
+        client = make_async_transfluent(token='foo', session=session)
+        run(client.file_translate('my-project/messages', 1, [11, 14]))
+        method, url, kwargs = session.requests[0]
+        assert method == 'POST'
+        assert url == 'https://transfluent.com/v2/file/translate'
+        assert sorted(kwargs['data']) == [
+            ('callback_url', ''),
+            ('comment', ''),
+            ('identifier', 'my-project/messages'),
+            ('language', '1'),
+            ('level', '3'),
+            ('target_languages[]', '11'),
+            ('target_languages[]', '14'),
+            ('token', 'foo'),
+        ]
+
+    def test_authenticate_sets_token(self):
+        session = FakeSession(FakeResponse(b'{"response":{"token":"foo"}}'))
+        client = make_async_transfluent(session=session)
+        run(client.authenticate(email='john@example.com', password='test'))
+        assert client.token == 'foo'
+
+    def test_set_customer_name(self):
+        session = FakeSession(FakeResponse(b'{"response":"OK"}'))
+        client = make_async_transfluent(token='foo', session=session)
+        run(client.set_customer_name('John Doe'))
+        method, url, kwargs = session.requests[0]
+        assert url == 'https://transfluent.com/v2/customer/name'
+        assert sorted(kwargs['data']) == [
+            ('name', 'John Doe'), ('token', 'foo')
+        ]
+
+    def test_languages_is_awaitable(self):
+        session = FakeSession(FakeResponse(b'{"response":[[1,"en-gb"]]}'))
+        client = make_async_transfluent(session=session)
+        assert run(client.languages) == [[1, 'en-gb']]
+
+    def test_is_file_complete(self):
+        session = FakeSession(FakeResponse(b'{"response":{"progress":"100%"}}'))
+        client = make_async_transfluent(token='foo', session=session)
+        assert run(client.is_file_complete('my-project/messages', 11)) is True
+
+    def test_close_does_not_close_given_session(self):
+        session = FakeSession()
+        client = make_async_transfluent(session=session)
+        run(client.close())
+        assert client.session is session
+
+
+def test_wait_for_callback():
+    import requests
+    from transfluent import CallbackListener
+    from transfluent_async import wait_for_callback
+
+    async def main(listener):
+        order = listener.expect()
+        waiter = asyncio.ensure_future(wait_for_callback(order, timeout=5))
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None, lambda: requests.get(order.url + '?status=ok')
+        )
+        return await waiter
+
+    with CallbackListener() as listener:
+        assert run(main(listener)) == {'status': 'ok'}
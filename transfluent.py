@@ -7,9 +7,27 @@
     :license: BSD, see LICENSE for more details.
 """
 import base64
+import codecs
+import copy
+import fnmatch
+import hashlib
+import io
+import json
+import mmap
+import os
+import random
+import re
+import socket
 import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
 
-import requests
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 __version__ = '0.3.0'
 
@@ -18,17 +36,2130 @@ TRANSFLUENT_URL = 'https://transfluent.com/v2/'
 
 PY2 = sys.version_info[0] == 2
 if not PY2:
+    from urllib.parse import parse_qs, urlencode, urlsplit
+    from urllib.parse import quote_from_bytes as quote_bytes
     iteritems = lambda x: iter(x.items())
+    string_types = (str,)
+    text_type = str
 else:
+    from urllib import quote as quote_bytes, urlencode
+    from urlparse import parse_qs, urlsplit
     iteritems = lambda x: x.iteritems()
+    string_types = (basestring,)  # noqa
+    text_type = unicode  # noqa
 
 
-class Transfluent(object):
-    def __init__(self, token=None):
+# requests, http.client, multiprocessing and the other modules that are slow
+# to import are imported on first use, so that importing this module stays
+# cheap for short-lived processes such as command line tools.
+
+def _httplib():
+    if PY2:
+        import httplib
+    else:
+        import http.client as httplib
+    return httplib
+
+
+def _thread_pool(processes):
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(processes)
+
+
+def _transport_exceptions():
+    """
+    Return the connection error and timeout exceptions of the HTTP
+    libraries that have been imported.  A library that has not been
+    imported cannot have raised anything.
+    """
+    exceptions = (socket.error,)
+    httplib = sys.modules.get('httplib' if PY2 else 'http.client')
+    if httplib is not None:
+        exceptions += (httplib.HTTPException,)
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        exceptions += (requests.ConnectionError, requests.Timeout)
+    return exceptions
+
+
+if orjson is not None:
+    _json_loads = orjson.loads
+else:
+    def _json_loads(content):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+
+#: The outcome of one batch of a bulk operation.  Exactly one of `response`
+#: and `error` is set.
+BatchResult = namedtuple('BatchResult', ['texts', 'response', 'error'])
+
+
+def _map_concurrently(func, items, max_workers):
+    """
+    Call `func` with each of `items` in a pool of `max_workers` threads.
+
+    Returns a list of ``(result, error)`` tuples in the order of `items`.
+    Exceptions raised by `func` are collected instead of propagated, so one
+    failing call does not abort the others.
+    """
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as exc:
+            return None, exc
+
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+    pool = _thread_pool(min(max_workers, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.terminate()
+
+
+_PATH_TYPES = (text_type,) + (
+    (os.PathLike,) if hasattr(os, 'PathLike') else ()
+)
+
+
+def _iter_file_chunks(file, chunk_size, encoding):
+    """
+    Yield the contents of `file` as byte strings of at most roughly
+    `chunk_size` bytes.  `file` may be a path given as text or a path
+    object, a file object opened in binary or text mode, or a bytes-like
+    object.  Byte strings are always content, also on Python 2.
+    """
+    if isinstance(file, _PATH_TYPES):
+        with open(file, 'rb') as f:
+            for chunk in _iter_file_chunks(f, chunk_size, encoding):
+                yield chunk
+    elif hasattr(file, 'read'):
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, text_type):
+                chunk = chunk.encode(encoding)
+            yield chunk
+    else:
+        view = memoryview(file)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size].tobytes()
+
+
+def _iter_base64_form_value(chunks):
+    """
+    Base64 encode and form encode a stream of byte strings.  The chunks are
+    re-aligned on three byte boundaries so that the encoded pieces can be
+    concatenated without padding in between.
+    """
+    leftover = b''
+    for chunk in chunks:
+        chunk = leftover + chunk
+        cut = len(chunk) - len(chunk) % 3
+        leftover = chunk[cut:]
+        if cut:
+            yield _quote_base64(base64.b64encode(chunk[:cut]))
+    if leftover:
+        yield _quote_base64(base64.b64encode(leftover))
+
+
+def _quote_base64(encoded):
+    return (
+        encoded
+        .replace(b'+', b'%2B')
+        .replace(b'/', b'%2F')
+        .replace(b'=', b'%3D')
+    )
+
+
+class _JSONStream(object):
+    """
+    A buffer over a stream of UTF-8 encoded JSON chunks that decodes one
+    value at a time.  Consumed input is dropped from the buffer.
+    """
+
+    _whitespace = ' \t\n\r'
+    _delimiters = _whitespace + ',:]}'
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size):
+        """Read until at least `size` characters are buffered."""
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while length < size and not self._eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                pieces.append(self._utf8.decode(b'', True))
+            else:
+                piece = self._utf8.decode(chunk)
+                pieces.append(piece)
+                length += len(piece)
+        self._buffer = u''.join(pieces)
+        return len(self._buffer) > 0
+
+    def peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in self._whitespace):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof or not self._fill(1):
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {0!r} at position {1}'.format(
+                char, self._pos
+            ))
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+            else:
+                # A number cut off by the end of a chunk decodes as a
+                # shorter number, so a value only counts as complete when
+                # it is followed by a delimiter.
+                if self._eof or (end < len(self._buffer) and
+                                 self._buffer[end] in self._delimiters):
+                    self._pos = end
+                    return value
+            # Grow the buffer geometrically so that a large value is not
+            # re-parsed once per chunk.
+            self._fill(2 * (len(self._buffer) - self._pos) + 1)
+
+    _special = re.compile(u'["\\\\]')
+    _escapes = {
+        u'"': u'"', u'\\': u'\\', u'/': u'/', u'b': u'\b', u'f': u'\f',
+        u'n': u'\n', u'r': u'\r', u't': u'\t',
+    }
+
+    def iter_string(self):
+        """
+        Decode the next value, which must be a string, and yield it in
+        pieces as it is read, so that a long string is never held in memory
+        as a whole.
+        """
+        self.expect('"')
+        while True:
+            buffer = self._buffer
+            pos = self._pos
+            pieces = []
+            while True:
+                match = self._special.search(buffer, pos)
+                end = len(buffer) if match is None else match.start()
+                if end > pos:
+                    pieces.append(buffer[pos:end])
+                pos = end
+                if match is None or buffer[pos] == '"':
+                    break
+                # A \uXXXX escape may be followed by the second half of a
+                # surrogate pair, so up to 12 characters are needed.
+                if len(buffer) - pos < 12 and not self._eof:
+                    break
+                char = buffer[pos + 1:pos + 2]
+                if char in self._escapes:
+                    pieces.append(self._escapes[char])
+                    pos += 2
+                elif char == 'u':
+                    escape = buffer[pos:pos + 6]
+                    if (buffer[pos + 6:pos + 8] == '\\u' and
+                            escape[2:3] in 'dD' and escape[3:4] in '89abAB'):
+                        escape = buffer[pos:pos + 12]
+                    pieces.append(json.loads(u'"{0}"'.format(escape)))
+                    pos += len(escape)
+                else:
+                    raise ValueError(
+                        'Invalid escape at position {0}'.format(pos)
+                    )
+            self._pos = pos
+            if pieces:
+                yield u''.join(pieces)
+            if pos < len(buffer) and buffer[pos] == '"':
+                self._pos += 1
+                return
+            if self._eof:
+                raise ValueError('Unterminated string')
+            self._fill(len(buffer) - pos + 1)
+
+
+def iter_json_items(chunks, key):
+    """
+    Incrementally parse a stream of UTF-8 encoded JSON chunks holding an
+    object, and yield the items of the array under `key`, or ``(key,
+    value)`` pairs if it is an object.  A scalar value is yielded as is.
+    Only the item being parsed is held in memory.
+    """
+    stream = _JSONStream(chunks)
+    stream.expect('{')
+    while stream.peek() != '}':
+        name = stream.value()
+        stream.expect(':')
+        if name != key:
+            stream.value()
+            if stream.peek() == ',':
+                stream.expect(',')
+            continue
+        opening = stream.peek()
+        if opening not in '[{':
+            yield stream.value()
+            return
+        closing = ']' if opening == '[' else '}'
+        stream.expect(opening)
+        while stream.peek() != closing:
+            if opening == '[':
+                yield stream.value()
+            else:
+                item_key = stream.value()
+                stream.expect(':')
+                yield item_key, stream.value()
+            if stream.peek() == ',':
+                stream.expect(',')
+        return
+
+
+def _iter_file_body(chunks, content_type=None, encoding='utf-8'):
+    """
+    Yield the content of a streamed :meth:`Transfluent.file_read` response
+    as byte strings.  The API sends the file either as the raw body, or as
+    a JSON string under ``response`` in a JSON body, which is decoded
+    incrementally and encoded with `encoding`.
+    """
+    chunks = iter(chunks)
+    # The whitespace-only chunks before the first content are kept, as
+    # they are part of a raw body.
+    skipped = []
+    for chunk in chunks:
+        skipped.append(chunk)
+        if chunk.strip():
+            break
+    first = b''.join(skipped)
+    is_json = first.lstrip().startswith(b'{') and (
+        not content_type or 'json' in content_type.lower()
+    )
+    if not is_json:
+        yield first
+        for chunk in chunks:
+            yield chunk
+        return
+    stream = _JSONStream(_chain([first], chunks))
+    stream.expect('{')
+    while stream.peek() != '}':
+        name = stream.value()
+        stream.expect(':')
+        if name != 'response':
+            stream.value()
+            if stream.peek() == ',':
+                stream.expect(',')
+            continue
+        if stream.peek() == '"':
+            for piece in stream.iter_string():
+                yield piece.encode(encoding)
+        else:
+            yield json.dumps(stream.value()).encode(encoding)
+        return
+    raise ValueError('No response in the JSON body')
+
+
+def _batch_texts(texts, batch_size, max_batch_bytes):
+    """
+    Split the `texts` dict into dicts of at most `batch_size` entries and
+    roughly `max_batch_bytes` bytes of UTF-8 encoded keys and contents.  A
+    single text larger than `max_batch_bytes` gets a batch of its own.
+    """
+    batch = {}
+    batch_bytes = 0
+    for key, content in iteritems(texts):
+        size = len(u'{0}{1}'.format(key, content).encode('utf-8'))
+        if batch and (len(batch) >= batch_size or
+                      batch_bytes + size > max_batch_bytes):
+            yield batch
+            batch = {}
+            batch_bytes = 0
+        batch[key] = content
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+# Chinese and Japanese are written without spaces between words, so each of
+# their characters is counted as a word.
+_CJK = u'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_WORD_PATTERN = u'[{0}]|[^\\s{0}]+'.format(_CJK)
+
+
+def count_words(text):
+    """
+    Estimate the number of words in `text`, counting whitespace-separated
+    words, with each Chinese or Japanese character counted as a word.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return len(re.findall(_WORD_PATTERN, text or u'', re.UNICODE))
+
+
+def _split_by_words(word_counts, max_words):
+    """
+    Split the ``(key, words)`` pairs of `word_counts` into lists of keys
+    whose word counts add up to at most `max_words`.  A single text longer
+    than `max_words` gets a list of its own.
+    """
+    batch = []
+    batch_words = 0
+    for key, words in word_counts:
+        if batch and batch_words + words > max_words:
+            yield batch
+            batch = []
+            batch_words = 0
+        batch.append(key)
+        batch_words += words
+    if batch:
+        yield batch
+
+
+def _content_hash(content):
+    if isinstance(content, text_type):
+        content = content.encode('utf-8')
+    elif not isinstance(content, bytes):
+        content = text_type(content).encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+class RetryPolicy(object):
+    """
+    Controls how failed requests are retried.
+
+    A request is retried when it fails with one of `exceptions` or with a
+    status code in `status_forcelist`, up to `total` times.  The delay
+    before each retry is picked randomly between zero and
+    ``backoff_factor * 2 ** retry`` seconds, capped at `max_backoff`
+    seconds ("full jitter").  If the response has a ``Retry-After`` header
+    and `respect_retry_after` is true, the delay it asks for is used
+    instead.
+
+    GET requests are idempotent and are always retried.  POST requests
+    are retried only if `retry_post` is true, because a POST that timed
+    out may have been processed by Transfluent already.  Streamed request
+    bodies are never retried.
+
+    :param exceptions:
+        The exception types to retry on. Defaults to connection errors
+        and timeouts of all the transports.
+    """
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=30,
+                 status_forcelist=(429, 500, 502, 503, 504),
+                 exceptions=None, retry_post=False,
+                 respect_retry_after=True):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = frozenset(status_forcelist)
+        if exceptions is not None:
+            exceptions = tuple(exceptions)
+        self.exceptions = exceptions
+        self.retry_post = retry_post
+        self.respect_retry_after = respect_retry_after
+
+    def is_retryable(self, method, retries, response=None, exception=None):
+        """
+        Return whether a request that has been retried `retries` times
+        should be retried after failing with `response` or `exception`.
+        """
+        if retries >= self.total:
+            return False
+        if method.upper() != 'GET' and not self.retry_post:
+            return False
+        if exception is not None:
+            exceptions = self.exceptions
+            if exceptions is None:
+                exceptions = _transport_exceptions()
+            return isinstance(exception, exceptions)
+        return response.status_code in self.status_forcelist
+
+    def get_backoff(self, retries, response=None):
+        """Return the number of seconds to sleep before the next retry."""
+        if response is not None and self.respect_retry_after:
+            retry_after = _parse_retry_after(
+                response.headers.get('Retry-After')
+            )
+            if retry_after is not None:
+                return retry_after
+        limit = min(self.max_backoff, self.backoff_factor * 2 ** retries)
+        return random.uniform(0, limit)
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class CircuitBreaker(object):
+    """
+    Fails requests fast while the Transfluent API appears to be down.
+
+    After `failure_threshold` consecutive failures (connection errors,
+    timeouts and 5xx responses) the circuit opens and requests raise
+    :class:`CircuitOpenError` without being sent.  After `reset_timeout`
+    seconds, one trial request is let through: if it succeeds the circuit
+    closes again, otherwise it stays open for another `reset_timeout`
+    seconds.  A circuit breaker may be shared between clients and threads.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, timer=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._timer = timer or getattr(time, 'monotonic', time.time)
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_request(self):
+        """Raise :class:`CircuitOpenError` if the request may not be sent."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = self._timer() - self._opened_at
+            if elapsed < self.reset_timeout or self._trial_in_progress:
+                raise CircuitOpenError(
+                    max(0, self.reset_timeout - elapsed)
+                )
+            self._trial_in_progress = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self._trial_in_progress or
+                    self.failures >= self.failure_threshold):
+                self._opened_at = self._timer()
+            self._trial_in_progress = False
+
+
+#: The events :meth:`Transfluent.register_hook` accepts.
+HOOK_EVENTS = ('before_send', 'after_response', 'on_error')
+
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
+
+class RequestInfo(object):
+    """
+    Describes a request attempt to the hooks registered with
+    :meth:`Transfluent.register_hook`.
+
+    :attr:`bytes_sent` is the size of the request body as sent, and
+    :attr:`bytes_sent_uncompressed` its size before compression.  They are
+    `None` if the size is not known.
+
+    :attr:`elapsed`, :attr:`status_code`, :attr:`bytes_received` and
+    :attr:`bytes_received_compressed` are set once the attempt has
+    finished.  :attr:`bytes_received` is the size of the decoded response
+    body, and :attr:`bytes_received_compressed` its size on the wire.  They
+    are `None` if the size of a streamed or compressed response is not
+    known.
+
+    Hooks may keep their own state for the attempt in the :attr:`context`
+    dict.
+    """
+
+    def __init__(self, method, path, url, retries, bytes_sent,
+                 bytes_sent_uncompressed=None):
+        self.method = method
+        self.path = path
+        self.url = url
+        self.retries = retries
+        self._bytes_sent = bytes_sent
+        if bytes_sent_uncompressed is None:
+            bytes_sent_uncompressed = bytes_sent
+        self._bytes_sent_uncompressed = bytes_sent_uncompressed
+        self.start = _perf_counter()
+        self.elapsed = None
+        self.status_code = None
+        self.bytes_received = None
+        self.bytes_received_compressed = None
+        self.context = {}
+
+    @property
+    def bytes_sent(self):
+        return _counted(self._bytes_sent)
+
+    @property
+    def bytes_sent_uncompressed(self):
+        return _counted(self._bytes_sent_uncompressed)
+
+    def finish(self, response=None, stream=False):
+        self.elapsed = _perf_counter() - self.start
+        if response is None:
+            return
+        self.status_code = response.status_code
+        length = response.headers.get('Content-Length')
+        length = int(length) if length else None
+        if not stream:
+            self.bytes_received = len(response.content)
+        elif not response.headers.get('Content-Encoding'):
+            self.bytes_received = length
+        if response.headers.get('Content-Encoding'):
+            self.bytes_received_compressed = length
+        else:
+            self.bytes_received_compressed = self.bytes_received
+
+
+def _counted(value):
+    # Streamed bodies are counted as they are sent into a one item list.
+    if isinstance(value, list):
+        return value[0]
+    return value
+
+
+def _request_size(kwargs):
+    """
+    Return the size of the form encoded query string and body of a
+    request, or `None` if the body is a stream.
+    """
+    size = 0
+    for key in ('params', 'data'):
+        value = kwargs.get(key)
+        if value is None:
+            continue
+        if isinstance(value, (bytes, text_type)):
+            size += len(value)
+        elif isinstance(value, (dict, list, tuple)):
+            items = iteritems(value) if isinstance(value, dict) else value
+            size += len(urlencode(list(items), doseq=True))
+        else:
+            return None
+    return size
+
+
+def _count_bytes(chunks):
+    """
+    Wrap a streamed request body to count the bytes sent.  Returns the
+    wrapped stream and a one item list holding the running count.
+    """
+    counter = [0]
+
+    def count():
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+
+    return count(), counter
+
+
+def _error_type(response):
+    try:
+        return response.json()['error']['type']
+    except (ValueError, KeyError, TypeError):
+        return 'HTTP {0}'.format(response.status_code)
+
+
+class RequestStats(object):
+    """
+    Collects per-endpoint request statistics: the number of requests,
+    retries and errors by type, bytes sent and received with and without
+    compression, and a latency histogram.  Install it on one or more
+    clients with :meth:`install` and export the statistics with
+    :meth:`as_dict`.
+
+    :param buckets:
+        The upper bounds of the latency histogram buckets in seconds.
+    """
+
+    def __init__(self, buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                1, 2.5, 5, 10)):
+        self.buckets = tuple(sorted(buckets))
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def install(self, client):
+        client.register_hook('after_response', self.after_response)
+        client.register_hook('on_error', self.on_error)
+        return self
+
+    def _endpoint(self, info):
+        key = '{0} {1}'.format(info.method.upper(), info.path)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = {
+                'requests': 0,
+                'retries': 0,
+                'errors': {},
+                'status_codes': {},
+                'bytes_sent': 0,
+                'bytes_sent_uncompressed': 0,
+                'bytes_received': 0,
+                'bytes_received_compressed': 0,
+                'latency': {
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                },
+            }
+        return endpoint
+
+    def _record(self, info):
+        endpoint = self._endpoint(info)
+        endpoint['requests'] += 1
+        if info.retries:
+            endpoint['retries'] += 1
+        endpoint['bytes_sent'] += info.bytes_sent or 0
+        endpoint['bytes_sent_uncompressed'] += (
+            info.bytes_sent_uncompressed or 0
+        )
+        latency = endpoint['latency']
+        latency['count'] += 1
+        latency['sum'] += info.elapsed
+        latency['max'] = max(latency['max'], info.elapsed)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if info.elapsed <= bound:
+                index = i
+                break
+        latency['buckets'][index] += 1
+        return endpoint
+
+    def _count_error(self, endpoint, error_type):
+        errors = endpoint['errors']
+        errors[error_type] = errors.get(error_type, 0) + 1
+
+    def after_response(self, info, response):
+        with self._lock:
+            endpoint = self._record(info)
+            endpoint['bytes_received'] += info.bytes_received or 0
+            endpoint['bytes_received_compressed'] += (
+                info.bytes_received_compressed or 0
+            )
+            status = endpoint['status_codes']
+            status[info.status_code] = status.get(info.status_code, 0) + 1
+            if info.status_code != 200:
+                self._count_error(endpoint, _error_type(response))
+
+    def on_error(self, info, exception):
+        with self._lock:
+            endpoint = self._record(info)
+            self._count_error(endpoint, type(exception).__name__)
+
+    def as_dict(self):
+        """
+        Return the statistics as a dict keyed by ``'<METHOD> <path>'``.
+        The latency histogram buckets are keyed by their upper bounds,
+        with ``'+Inf'`` for the last one.
+        """
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        with self._lock:
+            rv = {}
+            for key, endpoint in iteritems(self._endpoints):
+                endpoint = dict(endpoint)
+                latency = dict(endpoint['latency'])
+                latency['buckets'] = dict(zip(bounds, latency['buckets']))
+                endpoint['latency'] = latency
+                endpoint['errors'] = dict(endpoint['errors'])
+                endpoint['status_codes'] = dict(endpoint['status_codes'])
+                rv[key] = endpoint
+            return rv
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+class OpenTelemetryHooks(object):
+    """
+    Records every request attempt as an OpenTelemetry span.  Requires the
+    ``opentelemetry-api`` package unless a `tracer` is given.
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            from opentelemetry import trace
+            tracer = trace.get_tracer('transfluent', __version__)
+        self.tracer = tracer
+
+    def install(self, client):
+        client.register_hook('before_send', self.before_send)
+        client.register_hook('after_response', self.after_response)
+        client.register_hook('on_error', self.on_error)
+        return self
+
+    def before_send(self, info):
+        span = self.tracer.start_span(
+            'Transfluent {0} {1}'.format(info.method.upper(), info.path)
+        )
+        span.set_attribute('http.method', info.method.upper())
+        span.set_attribute('http.url', info.url)
+        span.set_attribute('transfluent.retries', info.retries)
+        info.context['otel_span'] = span
+
+    def after_response(self, info, response):
+        span = info.context.pop('otel_span')
+        span.set_attribute('http.status_code', info.status_code)
+        span.set_attribute('http.response_content_length',
+                           info.bytes_received)
+        if info.bytes_sent is not None:
+            span.set_attribute('http.request_content_length',
+                               info.bytes_sent)
+        span.end()
+
+    def on_error(self, info, exception):
+        span = info.context.pop('otel_span')
+        span.record_exception(exception)
+        span.end()
+
+
+class TTLCache(object):
+    """
+    A thread-safe in-memory cache whose entries expire after `ttl` seconds.
+    When the cache holds `maxsize` entries, the least recently used entry
+    is evicted to make room for a new one.
+
+    The number of cache hits and misses are counted in :attr:`hits` and
+    :attr:`misses`.
+    """
+
+    def __init__(self, ttl, maxsize=128, timer=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer or getattr(time, 'monotonic', time.time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return a ``(hit, value)`` tuple for `key`.  `value` is `None` when
+        the key is missing or has expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > self._timer():
+                self._entries[key] = entry
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+            self._entries[key] = (self._timer() + self.ttl, value)
+
+    def invalidate(self, predicate):
+        """Remove the entries whose keys match `predicate`."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RequestCoalescer(object):
+    """
+    Lets concurrent identical calls share one execution ("singleflight").
+
+    While a call for a key is in flight, other threads calling :meth:`do`
+    with the same key wait for it and get its result, or its exception,
+    instead of making the call again.  Once the call has finished, the
+    next call for the key is made afresh; nothing is cached.
+
+    The number of calls made and the number of calls saved by joining an
+    in-flight call are counted in :attr:`calls` and :attr:`coalesced`.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Call `func` unless a call for `key` is already in flight."""
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is None:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.event.set()
+        return call.result
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _cache_key(path, data):
+    if isinstance(data, (bytes, text_type)):
+        return path, data
+    items = []
+    for key, value in sorted(iteritems(data or {})):
+        if isinstance(value, list):
+            value = tuple(value)
+        items.append((key, value))
+    return path, tuple(items)
+
+
+class Manifest(object):
+    """
+    A local record of the content that has been saved to Transfluent,
+    stored as a hash per group id, language and key in an SQLite database.
+
+    It is used by :meth:`Transfluent.texts_save_incremental` to upload only
+    the texts that have changed since the last save.  :func:`sync` keeps
+    the hashes of the files it uploaded, and the translations it ordered
+    but has not written yet, in tables of their own.  A manifest may be
+    shared between threads.
+
+    :param path:
+        The path to the SQLite database file. It is created if it does
+        not exist. Use ``':memory:'`` for a manifest that is not persisted.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        import sqlite3
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS manifest ('
+                'group_id TEXT, language TEXT, key TEXT, hash TEXT, '
+                'PRIMARY KEY (group_id, language, key))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'identifier TEXT, language TEXT, hash TEXT, '
+                'PRIMARY KEY (identifier, language))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending_files ('
+                'identifier TEXT, language TEXT, '
+                'PRIMARY KEY (identifier, language))'
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def hashes(self, group_id, language):
+        """Return a dict of keys and content hashes saved for the group."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key, hash FROM manifest '
+                'WHERE group_id = ? AND language = ?',
+                (group_id, text_type(language))
+            )
+            return dict(rows.fetchall())
+
+    def update(self, group_id, language, hashes):
+        """Record the content hashes in the `hashes` dict as saved."""
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?)',
+                    [(group_id, text_type(language), key, hash)
+                     for key, hash in iteritems(hashes)]
+                )
+
+    def remove(self, group_id, language, keys):
+        """Forget the given keys of the group."""
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'DELETE FROM manifest '
+                    'WHERE group_id = ? AND language = ? AND key = ?',
+                    [(group_id, text_type(language), key) for key in keys]
+                )
+
+    def file_hashes(self, language):
+        """Return a dict of file identifiers and content hashes saved."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT identifier, hash FROM files WHERE language = ?',
+                (text_type(language),)
+            )
+            return dict(rows.fetchall())
+
+    def update_file(self, identifier, language, hash, targets):
+        """
+        Record the content hash of a file as saved, and its translations
+        into the `targets` languages as pending until they are removed
+        with :meth:`remove_pending_file`.
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                    (identifier, text_type(language), hash)
+                )
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO pending_files VALUES (?, ?)',
+                    [(identifier, text_type(target)) for target in targets]
+                )
+
+    def pending_files(self):
+        """
+        Return a list of the ``(identifier, language)`` pairs of the
+        pending translations.  The languages are strings.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT identifier, language FROM pending_files'
+            )
+            return rows.fetchall()
+
+    def remove_pending_file(self, identifier, language):
+        """Forget a pending translation once it has been written."""
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'DELETE FROM pending_files '
+                    'WHERE identifier = ? AND language = ?',
+                    (identifier, text_type(language))
+                )
+
+
+class DownloadCache(object):
+    """
+    A persistent local cache of downloaded translations, used by
+    :meth:`Transfluent.file_read_cached` and
+    :meth:`Transfluent.texts_read_cached`.
+
+    The contents are stored as files named by their SHA-1 hash under
+    `directory`, so identical translations are stored only once, and an
+    SQLite index records the hash and the status each entry was downloaded
+    with.  Binary contents are read back through :mod:`mmap`, so a large
+    file is paged in by the operating system as it is used instead of
+    being copied into memory.  A cache may be shared between threads.
+
+    :param directory:
+        The directory to store the cache in. It is created if it does not
+        exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        import sqlite3
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'index.sqlite'), check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'kind TEXT, key TEXT, language TEXT, hash TEXT, '
+                'encoding TEXT, status TEXT, fetched_at REAL, '
+                'PRIMARY KEY (kind, key, language))'
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def _path(self, hash):
+        return os.path.join(self.directory, hash[:2], hash[2:])
+
+    def entry(self, kind, key, language):
+        """
+        Return the ``(hash, status, fetched_at)`` of a cached entry, or
+        `None` if it is not cached.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT hash, status, fetched_at FROM entries '
+                'WHERE kind = ? AND key = ? AND language = ?',
+                (kind, key, text_type(language))
+            ).fetchone()
+        if row is None or not os.path.exists(self._path(row[0])):
+            return None
+        return row
+
+    def get(self, kind, key, language):
+        """
+        Return the cached content of an entry in the type it was stored
+        with, or `None` if it is not cached.  Binary content is returned as
+        a read-only :class:`mmap.mmap`, which supports the buffer protocol,
+        slicing and :func:`len` like :class:`bytes`.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT hash, encoding FROM entries '
+                'WHERE kind = ? AND key = ? AND language = ?',
+                (kind, key, text_type(language))
+            ).fetchone()
+        if row is None:
+            return None
+        hash, encoding = row
+        try:
+            f = open(self._path(hash), 'rb')
+        except IOError:
+            return None
+        with f:
+            if encoding != 'bytes':
+                content = f.read().decode('utf-8')
+                return json.loads(content) if encoding == 'json' else content
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def set(self, kind, key, language, content, status=None):
+        """
+        Store `content` for an entry, along with the `status` it was
+        downloaded with.  `content` may be bytes, text or any JSON
+        serializable value.
+        """
+        if isinstance(content, bytes):
+            encoding, data = 'bytes', content
+        elif isinstance(content, text_type):
+            encoding, data = 'text', content.encode('utf-8')
+        else:
+            encoding = 'json'
+            data = json.dumps(content, sort_keys=True).encode('utf-8')
+        hash = hashlib.sha1(data).hexdigest()
+        path = self._path(hash)
+        if not os.path.exists(path):
+            _atomic_write(path, [data])
+        with self._lock:
+            with self._connection:
+                old = self._connection.execute(
+                    'SELECT hash FROM entries '
+                    'WHERE kind = ? AND key = ? AND language = ?',
+                    (kind, key, text_type(language))
+                ).fetchone()
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (kind, key, text_type(language), hash, encoding,
+                     status, time.time())
+                )
+                if old is not None and old[0] != hash:
+                    self._remove_unreferenced(old[0])
+
+    def remove(self, kind, key, language):
+        """Forget a cached entry."""
+        with self._lock:
+            with self._connection:
+                row = self._connection.execute(
+                    'SELECT hash FROM entries '
+                    'WHERE kind = ? AND key = ? AND language = ?',
+                    (kind, key, text_type(language))
+                ).fetchone()
+                if row is None:
+                    return
+                self._connection.execute(
+                    'DELETE FROM entries '
+                    'WHERE kind = ? AND key = ? AND language = ?',
+                    (kind, key, text_type(language))
+                )
+                self._remove_unreferenced(row[0])
+
+    def _remove_unreferenced(self, hash):
+        count, = self._connection.execute(
+            'SELECT COUNT(*) FROM entries WHERE hash = ?', (hash,)
+        ).fetchone()
+        if not count:
+            try:
+                os.unlink(self._path(hash))
+            except OSError:
+                pass
+
+
+class WriteBehindQueue(object):
+    """
+    A durable write-behind queue for :meth:`Transfluent.texts_save` and
+    :meth:`Transfluent.file_save`.
+
+    The save methods of the queue record the writes in an SQLite journal
+    and return immediately.  A background thread flushes the journal to
+    Transfluent every `flush_interval` seconds.  Repeated writes to the
+    same text or file are coalesced, so only the latest content is sent,
+    and the texts of a group are saved in as few batches as possible with
+    :meth:`~Transfluent.texts_save_many`.
+
+    A write is removed from the journal only once it has been saved, so
+    writes that fail, or that were pending when the process died, are
+    sent again by the next flush.  Saving the same content twice is
+    harmless, which makes the replay safe.  The queue may be shared
+    between threads.
+
+    ::
+
+        with WriteBehindQueue(client, 'transfluent-journal.sqlite') as queue:
+            queue.texts_save('my-project/messages', 1, {'hello': 'Hello'})
+
+    :param client:
+        The :class:`Transfluent` client to save with.
+
+    :param path:
+        The path to the SQLite journal. It is created if it does not
+        exist.
+
+    :param flush_interval:
+        The number of seconds between flushes. Defaults to `1`.
+
+    :param batch_size:
+        The maximum number of texts per request. Defaults to `500`.
+
+    :param max_batch_bytes:
+        The approximate maximum size of the texts per request. Defaults to
+        1 MiB.
+
+    :param max_workers:
+        The maximum number of simultaneous requests. Defaults to `4`.
+
+    :param start:
+        Whether to start the background thread. Without it, the journal is
+        flushed only by :meth:`flush`. Defaults to `True`.
+    """
+
+    def __init__(self, client, path, flush_interval=1, batch_size=500,
+                 max_batch_bytes=1024 * 1024, max_workers=4, start=True):
+        import sqlite3
+        self.client = client
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_workers = max_workers
+        #: The exception of the last failed write, if any.
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._wakeup = threading.Event()
+        self._binary = sqlite3.Binary
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS texts ('
+                'group_id TEXT, language TEXT, key TEXT, content TEXT, '
+                'invalidate INTEGER, seq INTEGER, '
+                'PRIMARY KEY (group_id, language, key))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'identifier TEXT, language TEXT, content BLOB, type TEXT, '
+                'format TEXT, save_only_data INTEGER, seq INTEGER, '
+                'PRIMARY KEY (identifier, language))'
+            )
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self, flush=True):
+        """
+        Stop the background thread and close the journal.  Unless `flush`
+        is false, the pending writes are flushed first; writes that still
+        fail stay in the journal for the next run.
+        """
+        self._closed.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            self.flush()
+        self._connection.close()
+
+    def _next_seq(self):
+        seq, = self._connection.execute(
+            'SELECT MAX(COALESCE((SELECT MAX(seq) FROM texts), 0), '
+            'COALESCE((SELECT MAX(seq) FROM files), 0)) + 1'
+        ).fetchone()
+        return seq
+
+    def texts_save(self, group_id, language, texts,
+                   invalidate_translations=True):
+        """
+        Queue texts to be saved with :meth:`Transfluent.texts_save`.  A
+        text is invalidated if any of its coalesced writes asked for it.
+        """
+        language = text_type(language)
+        with self._lock:
+            with self._connection:
+                seq = self._next_seq()
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, '
+                    'MAX(?, COALESCE((SELECT invalidate FROM texts '
+                    'WHERE group_id = ? AND language = ? AND key = ?), 0)), '
+                    '?)',
+                    [(group_id, language, key, content,
+                      int(invalidate_translations), group_id, language, key,
+                      seq)
+                     for key, content in iteritems(texts)]
+                )
+
+    def file_save(self, identifier, language, file, type, format='UTF-8',
+                  save_only_data=False):
+        """
+        Queue a file to be saved with :meth:`Transfluent.file_save`.  The
+        content is read into the journal right away.
+        """
+        try:
+            content = file.read()
+        except AttributeError:
+            content = file.encode(format)
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO files '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (identifier, text_type(language), self._binary(content),
+                     type, format, int(save_only_data), self._next_seq())
+                )
+
+    @property
+    def pending(self):
+        """The number of texts and files waiting to be saved."""
+        with self._lock:
+            texts, = self._connection.execute(
+                'SELECT COUNT(*) FROM texts'
+            ).fetchone()
+            files, = self._connection.execute(
+                'SELECT COUNT(*) FROM files'
+            ).fetchone()
+        return texts + files
+
+    def flush(self):
+        """
+        Save the pending writes now.
+
+        :return:
+            A list of the exceptions of the writes that failed. They stay
+            in the journal.
+        """
+        with self._flush_lock:
+            errors = self._flush_texts() + self._flush_files()
+        if errors:
+            self.last_error = errors[-1]
+        return errors
+
+    def _flush_texts(self):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT group_id, language, invalidate, key, content, seq '
+                'FROM texts ORDER BY group_id, language, invalidate'
+            ).fetchall()
+        groups = OrderedDict()
+        for group_id, language, invalidate, key, content, seq in rows:
+            groups.setdefault((group_id, language, invalidate), {})[key] = (
+                content, seq
+            )
+        errors = []
+        for (group_id, language, invalidate), texts in iteritems(groups):
+            results = self.client.texts_save_many(
+                group_id, language,
+                dict((key, content) for key, (content, _) in iteritems(texts)),
+                bool(invalidate), self.batch_size, self.max_batch_bytes,
+                self.max_workers
+            )
+            saved = []
+            for result in results:
+                if result.error is not None:
+                    errors.append(result.error)
+                    continue
+                saved.extend(
+                    (group_id, language, key, texts[key][1])
+                    for key in result.texts
+                )
+            # A text written again during the flush has a new sequence
+            # number and stays in the journal.
+            with self._lock:
+                with self._connection:
+                    self._connection.executemany(
+                        'DELETE FROM texts WHERE group_id = ? AND '
+                        'language = ? AND key = ? AND seq = ?',
+                        saved
+                    )
+        return errors
+
+    def _flush_files(self):
+        with self._lock:
+            keys = self._connection.execute(
+                'SELECT identifier, language, seq FROM files'
+            ).fetchall()
+
+        def save(key):
+            identifier, language, seq = key
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT content, type, format, save_only_data FROM files '
+                    'WHERE identifier = ? AND language = ? AND seq = ?',
+                    key
+                ).fetchone()
+            if row is None:
+                return
+            content, type, format, save_only_data = row
+            self.client.file_save(
+                identifier, language, io.BytesIO(bytes(content)), type,
+                format, bool(save_only_data)
+            )
+            with self._lock:
+                with self._connection:
+                    self._connection.execute(
+                        'DELETE FROM files WHERE identifier = ? AND '
+                        'language = ? AND seq = ?',
+                        key
+                    )
+
+        results = _map_concurrently(save, keys, self.max_workers)
+        return [error for _, error in results if error is not None]
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as exc:
+                self.last_error = exc
+
+
+class CallbackOrder(object):
+    """
+    An order waiting for a callback from Transfluent.  Pass :attr:`url` as
+    the `callback_url` of :meth:`~Transfluent.texts_translate` or
+    :meth:`~Transfluent.file_translate`.  Created by
+    :meth:`CallbackListener.expect`.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.params = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the callback has been received and return its query
+        parameters as a dict.  Raises :class:`TransfluentTimeout` if the
+        callback does not arrive within `timeout` seconds.
+        """
+        if not self._event.wait(timeout):
+            raise TransfluentTimeout([self.url])
+        return self.params
+
+    def add_done_callback(self, func):
+        """
+        Call ``func(order)`` when the callback is received, or right away
+        if it has been received already.  `func` is called in the thread of
+        the listener.
+        """
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _resolve(self, params):
+        with self._lock:
+            self.params = params
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+
+def _callback_server(address, listener):
+    if PY2:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    else:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+    class CallbackServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class CallbackHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = dict(
+                (key, values[-1]) for key, values in
+                iteritems(parse_qs(url.query, keep_blank_values=True))
+            )
+            order = listener._pop(url.path.rstrip('/').split('/')[-1])
+            self.send_response(404 if order is None else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            if order is not None:
+                order._resolve(params)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CallbackServer(address, CallbackHandler)
+
+
+class CallbackListener(object):
+    """
+    An embedded HTTP server that receives the callbacks Transfluent makes
+    when translations are ready, so that they don't have to be polled for.
+    The server runs in a background thread.
+
+    ::
+
+        with CallbackListener(public_url='https://example.com:8080') as cb:
+            order = cb.expect()
+            client.file_translate(identifier, 1, [11],
+                                  callback_url=order.url)
+            order.wait(timeout=3600)
+
+    :param host:
+        The interface to listen on. Defaults to ``'127.0.0.1'``.
+
+    :param port:
+        The port to listen on. By default a free port is picked.
+
+    :param public_url:
+        Optional. The URL Transfluent can reach the listener at, if it is
+        behind a proxy or NAT. Defaults to the address being listened on.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, public_url=None):
+        self._server = _callback_server((host, port), self)
+        self._orders = {}
+        self._lock = threading.Lock()
+        if public_url is None:
+            public_url = 'http://{0}:{1}'.format(*self.address)
+        self.public_url = public_url.rstrip('/')
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def address(self):
+        """The ``(host, port)`` the listener is bound to."""
+        return self._server.server_address[:2]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def expect(self):
+        """Create a :class:`CallbackOrder` with a unique callback URL."""
+        import uuid
+        key = uuid.uuid4().hex
+        order = CallbackOrder('{0}/{1}'.format(self.public_url, key))
+        with self._lock:
+            self._orders[key] = order
+        return order
+
+    @property
+    def pending(self):
+        """The orders whose callback has not been received yet."""
+        with self._lock:
+            return list(self._orders.values())
+
+    def _pop(self, key):
+        with self._lock:
+            return self._orders.pop(key, None)
+
+
+class Response(object):
+    """
+    The response returned by transports other than
+    :class:`RequestsTransport`.  It has the subset of the
+    :class:`requests.Response` interface that the client uses.
+
+    A streamed response is created with an iterable of body `chunks`
+    instead of `content`.  Its body is read on demand, either all at once
+    through :attr:`content` or piece by piece with :meth:`iter_content`.
+    """
+
+    def __init__(self, status_code, headers, content=None, chunks=None,
+                 close=None):
+        self.status_code = status_code
+        self.headers = _Headers(headers)
+        self._content = content
+        self._chunks = chunks
+        self._close = close
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self.iter_content())
+        return self._content
+
+    def iter_content(self, chunk_size=None):
+        if self._content is not None:
+            yield self._content
+            return
+        try:
+            for chunk in self._chunks or ():
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def json(self):
+        return _json_loads(self.content)
+
+
+class _Headers(dict):
+    """A dict of HTTP headers with case-insensitive lookups."""
+
+    def __init__(self, headers=()):
+        super(_Headers, self).__init__(
+            (key.lower(), value) for key, value in headers
+        )
+
+    def __getitem__(self, key):
+        return super(_Headers, self).__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super(_Headers, self).__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super(_Headers, self).get(key.lower(), default)
+
+
+#: The content type of form encoded request bodies.
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+def _quote_form(value):
+    # The same as quote_plus(), minus its type checks, which take as long as
+    # the quoting itself.
+    if isinstance(value, text_type):
+        value = value.encode('utf-8')
+    elif not isinstance(value, bytes):
+        value = text_type(value).encode('utf-8')
+    return quote_bytes(value, ' ').replace(' ', '+')
+
+
+def encode_form(fields, bracketed=None):
+    """
+    Form encode request parameters to bytes in a single pass.
+
+    This produces the same encoding as requests does for a dict, but
+    without building the dict first, which matters for requests with tens
+    of thousands of texts.
+
+    :param fields:
+        An iterable of ``(key, value)`` pairs. List and tuple values are
+        encoded as repeated fields and `None` values are left out.
+
+    :param bracketed:
+        Optional. A ``(name, mapping)`` pair, whose items are encoded as
+        ``name[key]=value`` fields after `fields`.
+    """
+    parts = []
+    append = parts.append
+    for key, value in fields:
+        if value is None:
+            continue
+        key = _quote_form(key) + '='
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                append(key + _quote_form(item))
+        else:
+            append(key + _quote_form(value))
+    if bracketed is not None:
+        name, mapping = bracketed
+        prefix = _quote_form(name + '[')
+        suffix = _quote_form(']') + '='
+        for key, value in iteritems(mapping):
+            append(prefix + _quote_form(key) + suffix + _quote_form(value))
+    return '&'.join(parts).encode('ascii')
+
+
+def _form_items(params):
+    """
+    Return the ``(key, value)`` pairs of a dict or list of `params`
+    without `None` values, which requests leaves out too.
+    """
+    if isinstance(params, dict):
+        params = iteritems(params)
+    items = []
+    for key, value in params:
+        if isinstance(value, (list, tuple)):
+            value = [item for item in value if item is not None]
+        if value is not None:
+            items.append((key, value))
+    return items
+
+
+def _encode_query(url, params):
+    if not params:
+        return url
+    if isinstance(params, bytes):
+        query = params.decode('ascii')
+    elif isinstance(params, string_types):
+        query = params
+    else:
+        query = urlencode(_form_items(params), doseq=True)
+    return url + ('&' if '?' in url else '?') + query
+
+
+def _encode_body(data, headers):
+    """
+    Encode a request body the way requests does: dicts and lists of pairs
+    are form encoded without their `None` values, text is UTF-8 encoded, and anything else is treated
+    as an iterable of byte strings.  Returns the body and the headers.
+    """
+    headers = dict(headers or {})
+    if data is None or isinstance(data, bytes):
+        return data, headers
+    if isinstance(data, text_type):
+        return data.encode('utf-8'), headers
+    if isinstance(data, (dict, list, tuple)):
+        headers.setdefault('Content-Type', FORM_CONTENT_TYPE)
+        body = urlencode(_form_items(data), doseq=True).encode('ascii')
+        return body, headers
+    return data, headers
+
+
+#: The content codings supported for request and response bodies.
+CONTENT_ENCODINGS = ('gzip', 'deflate')
+
+
+def _compressor(encoding):
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError('Unsupported content encoding: {0}'.format(encoding))
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    return zlib.compressobj(6, zlib.DEFLATED, wbits)
+
+
+def _compress(body, encoding):
+    compressor = _compressor(encoding)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _iter_compressed(chunks, encoding):
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def _iter_decompressed(chunks):
+    """
+    Decompress a stream of gzip or deflate encoded chunks.  Some servers
+    send raw deflate data without the zlib header for ``deflate``, so that
+    is accepted too.
+    """
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    first = True
+    for chunk in chunks:
+        try:
+            chunk = decompressor.decompress(chunk)
+        except zlib.error:
+            if not first:
+                raise
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            chunk = decompressor.decompress(chunk)
+        first = False
+        if chunk:
+            yield chunk
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
+
+def _chain(*iterables):
+    for iterable in iterables:
+        for item in iterable:
+            yield item
+
+
+class RequestsTransport(object):
+    """
+    Makes the requests with a pooled, keep-alive :class:`requests.Session`.
+    This is the default transport.
+
+    :param session:
+        Optional. A :class:`requests.Session` to make the requests with.
+        An injected session is not closed by :meth:`close`.
+
+    :param pool_connections:
+        The number of per-host connection pools to cache. Ignored when
+        `session` is given.
+
+    :param pool_maxsize:
+        The maximum number of connections to keep alive in each per-host
+        pool. Ignored when `session` is given.
+
+    :param pool_block:
+        Whether to block when no free connections are available in the
+        pool instead of opening a new, unpooled connection. Ignored when
+        `session` is given.
+    """
+
+    def __init__(self, session=None, pool_connections=10, pool_maxsize=10,
+                 pool_block=False):
+        import requests
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=pool_block
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._owns_session = True
+        else:
+            self._owns_session = False
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+
+def _encode_chunked(chunks):
+    """Frame the byte strings `chunks` with the chunked transfer coding."""
+    for chunk in chunks:
+        if chunk:
+            size = '{0:X}\r\n'.format(len(chunk)).encode('ascii')
+            yield size + chunk + b'\r\n'
+    yield b'0\r\n\r\n'
+
+
+def _is_connection_dropped(connection):
+    """
+    Return whether the server has closed an idle kept-alive connection.
+    An idle socket only becomes readable when the server has closed it.
+    """
+    import select
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, select.error):
+        return True
+
+
+class HTTPClientTransport(object):
+    """
+    Makes the requests with the standard library's :mod:`http.client`,
+    keeping one connection per host and thread alive between requests.
+
+    A kept-alive connection that the server has closed in the meantime is
+    replaced before the request is sent.  If a kept-alive connection fails
+    while the request is being sent, the request is sent once more on a
+    new connection.  A failure after the request was sent is only retried
+    for ``GET`` requests, as the server may already have acted on it.
+    Timeouts are never retried here; use :class:`RetryPolicy` for those.
+
+    :param timeout:
+        The socket timeout in seconds. Defaults to `60`.
+
+    :param context:
+        Optional. The :class:`ssl.SSLContext` for HTTPS connections.
+
+    :param chunk_size:
+        The number of bytes to read at a time from streamed responses.
+        Defaults to 64 KiB.
+
+    :param decompress:
+        Whether to ask for gzip or deflate compressed responses and
+        decompress them on the fly. Defaults to `True`.
+    """
+
+    def __init__(self, timeout=60, context=None, chunk_size=64 * 1024,
+                 decompress=True):
+        self.timeout = timeout
+        self.context = context
+        self.chunk_size = chunk_size
+        self.decompress = decompress
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == 'https':
+                kwargs = {'timeout': self.timeout}
+                if self.context is not None:
+                    kwargs['context'] = self.context
+                connection = _httplib().HTTPSConnection(netloc, **kwargs)
+            else:
+                connection = _httplib().HTTPConnection(
+                    netloc, timeout=self.timeout
+                )
+            connection.served = 0
+            connections[(scheme, netloc)] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _discard(self, scheme, netloc, connection, close=True):
+        if close:
+            connection.close()
+        self._local.connections.pop((scheme, netloc), None)
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                stream=False):
+        parts = urlsplit(_encode_query(url, params))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        body, headers = _encode_body(data, headers)
+        if self.decompress:
+            headers.setdefault('Accept-Encoding', ', '.join(CONTENT_ENCODINGS))
+        streamed = body is not None and not isinstance(body, bytes)
+        if streamed and PY2:
+            body = b''.join(body)
+            streamed = False
+        elif streamed:
+            # The chunks are framed here because `encode_chunked` is only
+            # supported from Python 3.6 on.
+            headers['Transfer-Encoding'] = 'chunked'
+            body = _encode_chunked(body)
+        while True:
+            connection = self._connection(parts.scheme, parts.netloc)
+            if connection.served and _is_connection_dropped(connection):
+                self._discard(parts.scheme, parts.netloc, connection)
+                connection = self._connection(parts.scheme, parts.netloc)
+            reused = connection.served > 0
+            sent = False
+            try:
+                connection.request(method, path, body, headers)
+                sent = True
+                raw = connection.getresponse()
+                if not stream:
+                    content = raw.read()
+            except socket.timeout:
+                self._discard(parts.scheme, parts.netloc, connection)
+                raise
+            except (socket.error, _httplib().HTTPException):
+                self._discard(parts.scheme, parts.netloc, connection)
+                if (reused and not streamed and
+                        (not sent or method.upper() == 'GET')):
+                    continue
+                raise
+            connection.served += 1
+            encoding = (raw.getheader('Content-Encoding') or '').lower()
+            decompress = self.decompress and encoding in CONTENT_ENCODINGS
+            if stream:
+                # The connection is busy until the body has been read, so
+                # it is taken out of the pool and closed afterwards.
+                self._discard(parts.scheme, parts.netloc, connection,
+                              close=False)
+                chunks = iter(lambda: raw.read(self.chunk_size), b'')
+                if decompress:
+                    chunks = _iter_decompressed(chunks)
+                return Response(raw.status, raw.getheaders(), chunks=chunks,
+                                close=connection.close)
+            if raw.will_close:
+                self._discard(parts.scheme, parts.netloc, connection)
+            if decompress:
+                content = b''.join(_iter_decompressed([content]))
+            return Response(raw.status, raw.getheaders(), content)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class WSGITransport(object):
+    """
+    Dispatches the requests in-process to a WSGI application, such as a fake
+    Transfluent backend, without any sockets.  Useful for high-volume
+    integration tests and load simulations.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                stream=False):
+        parts = urlsplit(_encode_query(url, params))
+        body, headers = _encode_body(data, headers)
+        if body is not None and not isinstance(body, bytes):
+            body = b''.join(body)
+        body = body or b''
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': '',
+            'PATH_INFO': parts.path,
+            'QUERY_STRING': parts.query,
+            'SERVER_NAME': parts.hostname or 'localhost',
+            'SERVER_PORT': str(
+                parts.port or (443 if parts.scheme == 'https' else 80)
+            ),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': parts.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for key, value in iteritems(headers):
+            key = key.upper().replace('-', '_')
+            if key != 'CONTENT_TYPE':
+                key = 'HTTP_' + key
+            environ[key] = value
+        started = []
+        written = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [status, response_headers]
+            return written.append
+
+        result = self.app(environ, start_response)
+        close = getattr(result, 'close', None)
+        if stream:
+            chunks = iter(result)
+            # Applications may call start_response lazily, on the first
+            # iteration of their result.
+            first = next(chunks, b'')
+            status, response_headers = started
+            return Response(
+                int(status.split(' ', 1)[0]), response_headers,
+                chunks=_chain([b''.join(written), first], chunks),
+                close=close
+            )
+        try:
+            content = b''.join(written) + b''.join(result)
+        finally:
+            if close is not None:
+                close()
+        status, response_headers = started
+        return Response(int(status.split(' ', 1)[0]), response_headers,
+                        content)
+
+    def close(self):
+        pass
+
+
+#: The transports that can be passed to :class:`Transfluent` by name.
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'http.client': HTTPClientTransport,
+}
+
+
+class BaseTransfluent(object):
+    """
+    The request building logic and API methods shared by
+    :class:`Transfluent` and :class:`transfluent_async.AsyncTransfluent`.
+
+    Subclasses implement :meth:`_request`.  The API methods return
+    whatever :meth:`_request` returns, so an asynchronous subclass gets
+    awaitable API methods for free and only needs to override the methods
+    that post-process the response.
+    """
+
+    def __init__(self, token=None, url=None):
         self.token = token
-        self._transfluent_url = TRANSFLUENT_URL
+        self._transfluent_url = url or TRANSFLUENT_URL
 
-    def _request(self, method, path, data=None):
+    def _build_request(self, method, path, data=None, headers=None):
         url = self._transfluent_url + path
         kwargs = {}
         if method.upper() == 'GET':
@@ -37,21 +2168,32 @@ class Transfluent(object):
             kwargs['data'] = data
         else:
             raise ValueError('Unsupported request method: {0}'.format(method))
-        response = requests.request(method, url, **kwargs)
-        if response.status_code != 200:
-            raise TransfluentError(response)
-        try:
-            data = response.json()
-        except ValueError:
-            return response.content
-        else:
-            return data['response']
+        if headers:
+            kwargs['headers'] = headers
+        return url, kwargs
+
+    def _request(self, method, path, data=None, headers=None):
+        raise NotImplementedError
 
     def _authed_request(self, method, path, data=None):
-        data = data or {}
+        # The caller's dict is copied rather than modified, as it may be
+        # shared with other threads.
+        data = dict(data or {})
         data['token'] = self.token
         return self._request(method, path, data)
 
+    def _authed_form_request(self, method, path, fields, bracketed=None):
+        """
+        Like :meth:`_authed_request`, but the parameters are encoded with
+        :func:`encode_form` up front.  Used for the requests that carry
+        many texts.
+        """
+        form = encode_form([('token', self.token)] + fields, bracketed)
+        if method.upper() == 'GET':
+            return self._request(method, path, form.decode('ascii'))
+        return self._request(method, path, form,
+                             {'Content-Type': FORM_CONTENT_TYPE})
+
     def authenticate(self, email, password):
         data = {'email': email, 'password': password}
         response = self._request('GET', 'authenticate', data)
@@ -120,14 +2262,13 @@ class Transfluent(object):
 
         :type invalidate_translations: bool
         """
-        data = {
-            'group_id': group_id,
-            'language': language,
-            'invalidate_translations': 1 if invalidate_translations else 0,
-        }
-        for key, content in iteritems(texts):
-            data['texts[{0}]'.format(key)] = content
-        return self._authed_request('POST', 'texts', data)
+        fields = [
+            ('group_id', group_id),
+            ('language', language),
+            ('invalidate_translations', 1 if invalidate_translations else 0),
+        ]
+        return self._authed_form_request('POST', 'texts', fields,
+                                         ('texts', texts))
 
     def texts_read(self, group_id, language, limit=100, offset=0):
         """
@@ -221,17 +2362,17 @@ class Transfluent(object):
 
         :type max_words: int
         """
-        data = {
-            'group_id': group_id,
-            'source_language': language,
-            'target_languages[]': target_languages,
-            'texts[][id]': texts,
-            'level': kwargs.get('level', 3),
-            'comment': kwargs.get('comment', ''),
-            'callback_url': kwargs.get('callback_url', ''),
-            'max_words': kwargs.get('max_words', 1000)
-        }
-        return self._authed_request('GET', 'texts/translate', data)
+        fields = [
+            ('group_id', group_id),
+            ('source_language', language),
+            ('target_languages[]', target_languages),
+            ('texts[][id]', texts),
+            ('level', kwargs.get('level', 3)),
+            ('comment', kwargs.get('comment', '')),
+            ('callback_url', kwargs.get('callback_url', '')),
+            ('max_words', kwargs.get('max_words', 1000)),
+        ]
+        return self._authed_form_request('GET', 'texts/translate', fields)
 
     def file_save(self, identifier, language, file, type, format='UTF-8',
                   save_only_data=False):
@@ -279,9 +2420,849 @@ class Transfluent(object):
         return self._authed_request('GET', 'file/read', data)
 
 
+class Transfluent(BaseTransfluent):
+    """
+    A client for the Transfluent API.
+
+    The requests are made through a transport.  By default, this is a
+    :class:`RequestsTransport` with a pooled :class:`requests.Session`, so
+    the underlying TCP and TLS connections are kept alive and reused
+    between calls.  The client can be used as a context manager, in which
+    case its transport is closed when the block exits.
+
+    :param token:
+        Optional. The authentication token. See :meth:`authenticate`.
+
+    :param session:
+        Optional. A :class:`requests.Session` to make the requests with.
+        Use this to share a connection pool between several clients.  An
+        injected session is not closed by :meth:`close`. Ignored when
+        `transport` is given.
+
+    :param pool_connections:
+        The number of per-host connection pools to cache. Ignored when
+        `session` or `transport` is given. Defaults to `10`.
+
+    :param pool_maxsize:
+        The maximum number of connections to keep alive in each per-host
+        pool. Ignored when `session` or `transport` is given. Defaults to
+        `10`.
+
+    :param pool_block:
+        Whether to block when no free connections are available in the
+        pool instead of opening a new, unpooled connection. Ignored when
+        `session` or `transport` is given. Defaults to `False`.
+
+    :param cache_ttl:
+        Optional. The number of seconds to cache the responses of the
+        read-mostly endpoints in :attr:`cacheable_paths`, such as
+        :attr:`languages`. Setting a value through the API invalidates the
+        cached responses of its endpoint. Caching is disabled by default.
+
+    :param cache_maxsize:
+        The maximum number of cached responses. Defaults to `128`.
+
+    :param retry:
+        Optional. A :class:`RetryPolicy` for failed requests. By default,
+        requests are not retried.
+
+    :param circuit_breaker:
+        Optional. A :class:`CircuitBreaker` to fail fast with while the
+        Transfluent API is down.
+
+    :param hooks:
+        Optional. A dict of event names and lists of functions to call
+        around every request. See :meth:`register_hook`.
+
+    :param url:
+        Optional. The base URL of the API. Defaults to
+        :data:`TRANSFLUENT_URL`.
+
+    :param transport:
+        Optional. The transport to make the requests with, such as
+        :class:`HTTPClientTransport` or :class:`WSGITransport`, or the name
+        of one in :data:`TRANSPORTS`.  ``'http.client'`` needs nothing but
+        the standard library and avoids importing requests, which makes it
+        the fastest to start with.  If requests is not installed,
+        :class:`HTTPClientTransport` is used by default.
+
+    :param compress_requests:
+        Optional. ``'gzip'`` or ``'deflate'`` to compress POST request
+        bodies of at least `compress_min_size` bytes, such as the bodies of
+        :meth:`texts_save` and :meth:`file_save`. Only enable this if the
+        server accepts compressed requests. Disabled by default.
+
+    :param compress_min_size:
+        The minimum size of a request body to compress in bytes. Streamed
+        bodies are always compressed. Defaults to `1024`.
+
+    :param coalescer:
+        Optional. A :class:`RequestCoalescer` through which concurrent
+        identical GET requests to the endpoints in
+        :attr:`coalescable_paths` share one request.  Requests are
+        identical when their path and parameters, including the token, are
+        the same.  The callers then get the same response object, which
+        should not be modified.  Disabled by default.
+    """
+
+    #: The paths of the endpoints whose GET responses are cached when
+    #: `cache_ttl` is set.
+    cacheable_paths = frozenset(['languages', 'customer/name',
+                                 'customer/email'])
+
+    #: The paths of the endpoints whose concurrent identical GET requests
+    #: are coalesced when a `coalescer` is set.  These requests have no
+    #: side effects, unlike ordering translations with ``texts/translate``.
+    coalescable_paths = frozenset(['languages', 'customer/name',
+                                   'customer/email', 'file/status',
+                                   'file/read', 'texts'])
+
+    def __init__(self, token=None, session=None, pool_connections=10,
+                 pool_maxsize=10, pool_block=False, cache_ttl=None,
+                 cache_maxsize=128, retry=None, circuit_breaker=None,
+                 hooks=None, url=None, transport=None,
+                 compress_requests=None, compress_min_size=1024,
+                 coalescer=None):
+        super(Transfluent, self).__init__(token, url)
+        if compress_requests is not None:
+            _compressor(compress_requests)
+        self.compress_requests = compress_requests
+        self.compress_min_size = compress_min_size
+        self.hooks = dict((event, []) for event in HOOK_EVENTS)
+        for event, functions in iteritems(hooks or {}):
+            for function in functions:
+                self.register_hook(event, function)
+        self.retry = retry
+        self.circuit_breaker = circuit_breaker
+        self.coalescer = coalescer
+        self.cache = None
+        if cache_ttl is not None:
+            self.cache = TTLCache(cache_ttl, cache_maxsize)
+        if transport is None:
+            try:
+                transport = RequestsTransport(
+                    session, pool_connections, pool_maxsize, pool_block
+                )
+            except ImportError:
+                if session is not None:
+                    raise
+                transport = HTTPClientTransport()
+        elif isinstance(transport, string_types):
+            if transport not in TRANSPORTS:
+                raise ValueError(
+                    'Unsupported transport: {0}'.format(transport)
+                )
+            transport = TRANSPORTS[transport]()
+        self.transport = transport
+        self._shared_with = None
+
+    @property
+    def session(self):
+        """The :class:`requests.Session` of a :class:`RequestsTransport`."""
+        return self.transport.session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the connections of the transport.
+
+        Sessions passed to the constructor are left open, as they may be
+        shared with other clients.  Closing a view created with
+        :meth:`for_token` does nothing, as its transport belongs to the
+        client it was created from.
+        """
+        if self._shared_with is None:
+            self.transport.close()
+
+    def for_token(self, token):
+        """
+        Return a view of this client that authenticates with `token`.
+
+        The view shares the transport and its connection pool, the cache,
+        the hooks (and so any installed :class:`RequestStats`), the retry
+        policy and the circuit breaker with this client, so creating one is
+        cheap.  Responses are cached per token.  Use it to serve many
+        customers from one client shared between threads, instead of
+        changing :attr:`token`, which would race with other threads::
+
+            client = Transfluent(cache_ttl=300)
+
+            def handle(customer):
+                tenant = client.for_token(customer.transfluent_token)
+                return tenant.file_status(customer.identifier, 11)
+        """
+        view = copy.copy(self)
+        view.token = token
+        view._shared_with = self._shared_with or self
+        return view
+
+    def register_hook(self, event, hook):
+        """
+        Register a function to be called around every request attempt.
+
+        The events are:
+
+        - ``'before_send'``, called with a :class:`RequestInfo` before the
+          request is sent.
+        - ``'after_response'``, called with the :class:`RequestInfo` and
+          the response once it has been received, whatever its status.
+        - ``'on_error'``, called with the :class:`RequestInfo` and the
+          exception if no response was received.
+
+        Retried requests call the hooks once per attempt.
+        """
+        if event not in self.hooks:
+            raise ValueError('Unsupported hook event: {0}'.format(event))
+        self.hooks[event].append(hook)
+
+    def _run_hooks(self, event, *args):
+        for hook in self.hooks[event]:
+            hook(*args)
+
+    def refresh(self):
+        """Discard all cached responses."""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _request(self, method, path, data=None, headers=None):
+        if self.cache is None or path not in self.cacheable_paths:
+            return self._coalesced_send(method, path, data, headers)
+        if method.upper() != 'GET':
+            rv = self._send(method, path, data, headers)
+            self.cache.invalidate(lambda key: key[0] == path)
+            return rv
+        key = _cache_key(path, data)
+        hit, rv = self.cache.get(key)
+        if not hit:
+            rv = self._coalesced_send(method, path, data, headers)
+            self.cache.set(key, rv)
+        return rv
+
+    def _coalesced_send(self, method, path, data=None, headers=None):
+        if (self.coalescer is None or method.upper() != 'GET' or
+                path not in self.coalescable_paths):
+            return self._send(method, path, data, headers)
+        return self.coalescer.do(
+            _cache_key(path, data),
+            lambda: self._send(method, path, data, headers)
+        )
+
+    def _send(self, method, path, data=None, headers=None):
+        response = self._send_request(method, path, data, headers)
+        try:
+            data = _json_loads(response.content)
+        except ValueError:
+            return response.content
+        else:
+            return data['response']
+
+    def _send_request(self, method, path, data=None, headers=None,
+                      stream=False):
+        """
+        Send a request, retrying it according to :attr:`retry`, and return
+        the successful response.  Raises :class:`TransfluentError` if the
+        request fails.
+        """
+        retry = self.retry
+        if not isinstance(data, (dict, list, tuple, bytes, text_type,
+                                 type(None))):
+            retry = None
+        observed = any(self.hooks.values())
+        uncompressed = None
+        if (self.compress_requests and data is not None and
+                method.upper() == 'POST'):
+            data, headers, uncompressed = self._compress_body(data, headers)
+        url, kwargs = self._build_request(method, path, data, headers)
+        if stream:
+            kwargs['stream'] = True
+        bytes_sent = None
+        if observed:
+            bytes_sent = _request_size(kwargs)
+            if bytes_sent is None and 'data' in kwargs:
+                kwargs['data'], counter = _count_bytes(kwargs['data'])
+                bytes_sent = counter
+        breaker = self.circuit_breaker
+        retries = 0
+        while True:
+            if breaker is not None:
+                breaker.before_request()
+            info = RequestInfo(method, path, url, retries, bytes_sent,
+                               uncompressed)
+            if observed:
+                self._run_hooks('before_send', info)
+            try:
+                response = self.transport.request(method, url, **kwargs)
+            except Exception as exc:
+                if observed:
+                    info.finish()
+                    self._run_hooks('on_error', info, exc)
+                if breaker is not None:
+                    breaker.record_failure()
+                if retry is None or not retry.is_retryable(method, retries,
+                                                           exception=exc):
+                    raise
+                delay = retry.get_backoff(retries)
+            else:
+                if observed:
+                    info.finish(response, stream)
+                    self._run_hooks('after_response', info, response)
+                if breaker is not None:
+                    if response.status_code >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if response.status_code == 200:
+                    break
+                if retry is None or not retry.is_retryable(
+                        method, retries, response=response):
+                    raise TransfluentError(response)
+                delay = retry.get_backoff(retries, response)
+            time.sleep(delay)
+            retries += 1
+        return response
+
+    def _compress_body(self, data, headers):
+        """
+        Encode and compress a request body with :attr:`compress_requests`.
+        Returns the body, the headers and the uncompressed size, which is
+        a running count for streamed bodies.
+        """
+        body, headers = _encode_body(data, headers)
+        if isinstance(body, bytes):
+            if len(body) < self.compress_min_size:
+                return body, headers, None
+            size = len(body)
+            body = _compress(body, self.compress_requests)
+        else:
+            body, size = _count_bytes(body)
+            body = _iter_compressed(body, self.compress_requests)
+        headers['Content-Encoding'] = self.compress_requests
+        return body, headers, size
+
+    def _request_items(self, method, path, data=None, chunk_size=64 * 1024):
+        """
+        Make a request and yield the items of the ``response`` array of
+        the JSON body as they are parsed from the streamed response, or
+        ``(key, value)`` pairs if ``response`` is an object.  Only one item
+        at a time is held in memory.
+        """
+        response = self._send_request(method, path, data, stream=True)
+        try:
+            chunks = response.iter_content(chunk_size)
+            for item in iter_json_items(chunks, 'response'):
+                yield item
+        finally:
+            response.close()
+
+    def texts_read_stream(self, group_id, language, limit=100, offset=0):
+        """
+        Read texts like :meth:`texts_read`, but parse the response
+        incrementally and yield the texts one by one as they arrive.  Texts
+        returned as a dict are yielded as ``(key, value)`` pairs.  This
+        keeps memory use low when reading large pages.
+        """
+        data = {
+            'group_id': group_id,
+            'language': language,
+            'limit': limit,
+            'offset': offset,
+            'token': self.token,
+        }
+        return self._request_items('GET', 'texts', data)
+
+    def file_read_to(self, identifier, language, destination,
+                     encoding='utf-8', chunk_size=64 * 1024):
+        """
+        Read a translated file like :meth:`file_read`, but stream it to
+        the `destination` path instead of returning it.
+
+        The response is written to a temporary file next to `destination`
+        `chunk_size` bytes at a time, so memory use does not grow with the
+        size of the file.  The temporary file then atomically replaces
+        `destination`, so other processes see either the old file or the
+        complete new one.  If the download fails, `destination` is left as
+        it was.
+
+        :param encoding:
+            The encoding to write a file sent as a JSON string in. Files
+            sent as the raw body are written as they are. Defaults to
+            ``'utf-8'``.
+
+        :return:
+            The number of bytes written.
+        """
+        data = {
+            'identifier': identifier,
+            'language': language,
+            'token': self.token,
+        }
+        response = self._send_request('GET', 'file/read', data, stream=True)
+        try:
+            chunks, size = _count_bytes(_iter_file_body(
+                response.iter_content(chunk_size),
+                response.headers.get('Content-Type'),
+                encoding
+            ))
+            _atomic_write(destination, chunks)
+        finally:
+            response.close()
+        return size[0]
+
+    def file_save_streaming(self, identifier, language, file, type,
+                            format='UTF-8', save_only_data=False,
+                            chunk_size=3 * 64 * 1024):
+        """
+        Save a file like :meth:`file_save`, but read, encode and upload it
+        in chunks so that memory use stays constant regardless of the file
+        size.  The request body is sent with chunked transfer encoding.
+
+        :param file:
+            A path to the file, as text or a path object, a file object or
+            a bytes-like object such as a :class:`memoryview`. Text read
+            from files opened in text mode is encoded with `format`.
+            Unlike with :meth:`file_save`, a text string is a path and not
+            the content.
+
+        :param chunk_size:
+            The number of bytes to read at a time. Defaults to 192 KiB.
+
+        :type chunk_size: int
+        """
+        fields = urlencode([
+            ('token', self.token),
+            ('identifier', identifier),
+            ('language', language),
+            ('format', format),
+            ('type', type),
+            ('save_only_data', int(save_only_data)),
+        ]).encode('ascii')
+
+        def body():
+            yield fields + b'&content='
+            chunks = _iter_file_chunks(file, chunk_size, format)
+            for piece in _iter_base64_form_value(chunks):
+                yield piece
+
+        headers = {'Content-Type': FORM_CONTENT_TYPE}
+        return self._request('POST', 'file/save', body(), headers)
+
+    def texts_save_incremental(self, group_id, language, texts, manifest,
+                               invalidate_translations=True,
+                               delete_removed=False):
+        """
+        Save only the texts that are new or have changed since they were
+        last saved through `manifest`.  If nothing has changed, no request
+        is made.
+
+        :param manifest:
+            The :class:`Manifest` to compare the texts against. It is
+            updated once the texts have been saved successfully.
+
+        :param delete_removed:
+            Optional. Whether to forget the keys that are in the manifest
+            but no longer in `texts`. The Transfluent API has no way to
+            delete texts, so they are only removed from the manifest.
+            Defaults to `False`.
+
+        :return:
+            A dict with the lists of ``'saved'``, ``'skipped'`` and
+            ``'removed'`` keys, and the ``'response'`` of
+            :meth:`texts_save`, which is `None` if nothing was saved.
+        """
+        saved_hashes = manifest.hashes(group_id, language)
+        changed = {}
+        hashes = {}
+        skipped = []
+        for key, content in iteritems(texts):
+            hash = _content_hash(content)
+            if saved_hashes.get(text_type(key)) == hash:
+                skipped.append(key)
+            else:
+                changed[key] = content
+                hashes[key] = hash
+        response = None
+        if changed:
+            response = self.texts_save(
+                group_id, language, changed, invalidate_translations
+            )
+            manifest.update(group_id, language, hashes)
+        removed = []
+        if delete_removed:
+            keys = set(text_type(key) for key in texts)
+            removed = [key for key in saved_hashes if key not in keys]
+            manifest.remove(group_id, language, removed)
+        return {
+            'saved': list(changed),
+            'skipped': skipped,
+            'removed': removed,
+            'response': response,
+        }
+
+    def texts_save_many(self, group_id, language, texts,
+                        invalidate_translations=True, batch_size=500,
+                        max_batch_bytes=1024 * 1024, max_workers=4):
+        """
+        Save a large number of texts in concurrent batches.
+
+        The `texts` dict is split into batches of at most `batch_size`
+        texts and approximately `max_batch_bytes` bytes, and each batch is
+        saved with :meth:`texts_save`.  A failing batch does not stop the
+        others.
+
+        .. warning::
+        `invalidate_translations` is applied to every batch, so it still
+        affects ALL the given texts. If you need to invalidate some and
+        keep others, you have to make two calls.
+
+        :param max_workers:
+            The maximum number of batches to save simultaneously. Defaults
+            to `4`.
+
+        :type max_workers: int
+
+        :return:
+            A list of :class:`BatchResult` tuples, one per batch, in the
+            order the batches were created.
+        """
+        batches = list(_batch_texts(texts, batch_size, max_batch_bytes))
+
+        def save(batch):
+            return self.texts_save(
+                group_id, language, batch, invalidate_translations
+            )
+
+        results = _map_concurrently(save, batches, max_workers)
+        return [
+            BatchResult(batch, response, error)
+            for batch, (response, error) in zip(batches, results)
+        ]
+
+    def texts_word_counts(self, group_id, language, texts=None,
+                          page_size=100):
+        """
+        Estimate the word counts of the texts saved in a group with
+        :func:`count_words`.
+
+        :param texts:
+            Optional. A list of text ids to count. Defaults to all texts in
+            the group.
+
+        :return:
+            A dict of text ids and their word counts.
+        """
+        wanted = None if texts is None else set(texts)
+        counts = {}
+        for item in self.iter_texts(group_id, language, page_size):
+            if isinstance(item, dict):
+                key, content = item['id'], item['text']
+            else:
+                key, content = item
+            if wanted is None or key in wanted:
+                counts[key] = count_words(content)
+        return counts
+
+    def texts_translate_many(self, group_id, language, target_languages,
+                             texts, max_workers=4, **kwargs):
+        """
+        Order translations for any number of texts, splitting the order so
+        that each part stays under `max_words`.
+
+        The words are counted locally with :func:`count_words`, and as the
+        limit covers the whole order, they are multiplied by the number of
+        `target_languages`.  The parts are ordered with
+        :meth:`texts_translate` concurrently, and a failing part does not
+        stop the others.
+
+        :param texts:
+            Either a dict of text ids and their source texts, or a list of
+            text ids whose source texts are then read from the group with
+            :meth:`texts_word_counts`.
+
+        :param max_workers:
+            The maximum number of orders to make simultaneously. Defaults
+            to `4`.
+
+        :type max_workers: int
+
+        The other keyword arguments, including `max_words`, are the same as
+        for :meth:`texts_translate`.
+
+        :return:
+            A list of :class:`BatchResult` tuples whose `texts` are the
+            lists of text ids of each order.
+        """
+        # The text ids keep the order they were given in.
+        if isinstance(texts, dict):
+            counts = [
+                (key, count_words(content))
+                for key, content in iteritems(texts)
+            ]
+        else:
+            word_counts = self.texts_word_counts(group_id, language, texts)
+            # Texts the group does not have are left for the server to
+            # reject, without counting against any order.
+            counts = [(key, word_counts.get(key, 0)) for key in texts]
+        targets = max(len(target_languages), 1)
+        max_words = kwargs.get('max_words', 1000)
+        batches = list(_split_by_words(
+            ((key, words * targets) for key, words in counts), max_words
+        ))
+
+        def translate(batch):
+            return self.texts_translate(
+                group_id, language, target_languages, batch, **kwargs
+            )
+
+        results = _map_concurrently(translate, batches, max_workers)
+        return [
+            BatchResult(batch, response, error)
+            for batch, (response, error) in zip(batches, results)
+        ]
+
+    def file_read_cached(self, identifier, language, cache):
+        """
+        Read a translated file through a :class:`DownloadCache`.
+
+        The status of the file is checked with :meth:`file_status`, and
+        the file is downloaded with :meth:`file_read` only if the status
+        has changed since the cached copy was downloaded.  Otherwise the
+        cached copy is returned without downloading it again.
+
+        :return:
+            The content like :meth:`file_read`, except that binary content
+            served from the cache is a read-only :class:`mmap.mmap` of the
+            cached file.
+        """
+        status = json.dumps(
+            self.file_status(identifier, language), sort_keys=True
+        )
+        entry = cache.entry('file', identifier, language)
+        if entry is not None and entry[1] == status:
+            content = cache.get('file', identifier, language)
+            if content is not None:
+                return content
+        content = self.file_read(identifier, language)
+        cache.set('file', identifier, language, content, status)
+        return content
+
+    def texts_read_cached(self, group_id, language, cache, max_age,
+                          limit=100, offset=0):
+        """
+        Read texts through a :class:`DownloadCache`.
+
+        The API has no way to tell whether texts have changed, so the
+        cached page is returned if it was downloaded less than `max_age`
+        seconds ago, and is otherwise read again with :meth:`texts_read`.
+        """
+        key = u'{0}?limit={1}&offset={2}'.format(group_id, limit, offset)
+        entry = cache.entry('texts', key, language)
+        if entry is not None and time.time() - entry[2] < max_age:
+            content = cache.get('texts', key, language)
+            if content is not None:
+                return content
+        content = self.texts_read(group_id, language, limit, offset)
+        cache.set('texts', key, language, content)
+        return content
+
+    def _file_many(self, func, identifier, languages, max_workers):
+        languages = list(languages)
+        results = _map_concurrently(
+            lambda language: func(identifier, language),
+            languages,
+            max_workers
+        )
+        responses = {}
+        errors = {}
+        for language, (response, error) in zip(languages, results):
+            if error is None:
+                responses[language] = response
+            else:
+                errors[language] = error
+        return responses, errors
+
+    def file_status_many(self, identifier, languages, max_workers=8):
+        """
+        Call :meth:`file_status` for several languages concurrently.
+
+        :param max_workers:
+            The maximum number of simultaneous requests. Defaults to `8`.
+
+        :type max_workers: int
+
+        :return:
+            A tuple of two dicts keyed by language: the statuses of the
+            languages that succeeded and the exceptions of the languages
+            that failed.
+        """
+        return self._file_many(
+            self.file_status, identifier, languages, max_workers
+        )
+
+    def file_read_many(self, identifier, languages, max_workers=8):
+        """
+        Call :meth:`file_read` for several languages concurrently.
+
+        :param max_workers:
+            The maximum number of simultaneous requests. Defaults to `8`.
+
+        :type max_workers: int
+
+        :return:
+            A tuple of two dicts keyed by language: the files of the
+            languages that succeeded and the exceptions of the languages
+            that failed.
+        """
+        return self._file_many(
+            self.file_read, identifier, languages, max_workers
+        )
+
+    def wait_for_files(self, pairs, timeout=None, max_concurrency=8,
+                       read=False, initial_delay=1, max_delay=60,
+                       backoff=2):
+        """
+        Wait for the translation of several files to complete.
+
+        The `pairs` of ``(identifier, language)`` are polled with
+        :meth:`file_status` concurrently.  Each pair that is not yet
+        complete is polled again after a delay that starts at
+        `initial_delay` seconds and grows by the factor `backoff` up to
+        `max_delay` seconds, with random jitter so that the polls of
+        different pairs spread out.  A pair is no longer polled once its
+        progress reaches ``'100%'``.
+
+        This is a generator that yields the pairs as they complete.  If
+        `read` is true, the files are also fetched with :meth:`file_read`
+        and ``(identifier, language, content)`` tuples are yielded instead.
+
+        A pair whose status or content cannot be fetched is no longer
+        polled, but the other pairs are.  Once no pair is left to poll,
+        :class:`TransfluentWaitError` is raised with the exceptions of the
+        pairs that failed.
+
+        :param timeout:
+            Optional. The number of seconds to wait in total before
+            raising :class:`TransfluentTimeout`. Waits forever by default.
+
+        :param max_concurrency:
+            The maximum number of simultaneous requests. Defaults to `8`.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        pending = dict((tuple(pair), (0, initial_delay)) for pair in pairs)
+
+        completed = []
+        errors = {}
+
+        def poll(pair):
+            identifier, language = pair
+            try:
+                if not self.is_file_complete(identifier, language):
+                    return pair, False, None, None
+                if read:
+                    content = self.file_read(identifier, language)
+                    return pair, True, content, None
+                return pair, True, None, None
+            except Exception as exc:
+                return pair, False, None, exc
+
+        pool = _thread_pool(max_concurrency)
+        try:
+            while pending:
+                now = time.time()
+                due = [pair for pair, (at, _) in iteritems(pending)
+                       if at <= now]
+                for pair, complete, content, error in pool.imap_unordered(
+                        poll, due):
+                    if error is not None:
+                        del pending[pair]
+                        errors[pair] = error
+                    elif complete:
+                        del pending[pair]
+                        completed.append(pair)
+                        yield pair + (content,) if read else pair
+                    else:
+                        delay = pending[pair][1]
+                        pending[pair] = (
+                            time.time() + delay * random.uniform(0.5, 1),
+                            min(delay * backoff, max_delay)
+                        )
+                if not pending:
+                    break
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    raise TransfluentTimeout(
+                        list(pending), errors, completed
+                    )
+                wake_at = min(at for at, _ in pending.values())
+                if deadline is not None:
+                    wake_at = min(wake_at, deadline)
+                if wake_at > now:
+                    time.sleep(wake_at - now)
+        finally:
+            pool.terminate()
+        if errors:
+            raise TransfluentWaitError(errors, completed)
+
+    def iter_texts(self, group_id, language, page_size=100):
+        """
+        Iterate over all texts in a group, one text at a time.
+
+        The texts are read with :meth:`texts_read`, `page_size` texts at a
+        time.  The next page is fetched in a background thread while the
+        current page is being consumed, so at most two pages are held in
+        memory regardless of the size of the group.
+
+        Pages returned as lists yield their items and pages returned as
+        dicts yield ``(key, value)`` pairs.
+
+        :param group_id:
+            Group id for texts.
+
+        :type group_id: str
+
+        :param language:
+            The human language of the texts.
+
+        :type language: int
+
+        :param page_size:
+            The number of texts to read per request. Defaults to `100`.
+
+        :type page_size: int
+        """
+        pool = _thread_pool(1)
+        try:
+            offset = 0
+            pending = pool.apply_async(
+                self.texts_read, (group_id, language, page_size, offset)
+            )
+            while pending is not None:
+                page = pending.get()
+                offset += page_size
+                if page and len(page) >= page_size:
+                    pending = pool.apply_async(
+                        self.texts_read,
+                        (group_id, language, page_size, offset)
+                    )
+                else:
+                    pending = None
+                if isinstance(page, dict):
+                    page = iteritems(page)
+                for text in page or ():
+                    yield text
+                page = None
+        finally:
+            pool.terminate()
+
+
 class TransfluentError(Exception):
-    def __init__(self, response):
-        data = response.json()
+    def __init__(self, response, data=None):
+        if data is None:
+            data = response.json()
         self.response = response
         self.type = data['error']['type']
         self.message = data['error']['message']
@@ -291,3 +3272,415 @@ class TransfluentError(Exception):
 
     def __str__(self):
         return self.message
+
+
+class TransfluentWaitError(Exception):
+    """
+    Raised by :meth:`Transfluent.wait_for_files` when some of the files
+    could not be waited for.  :attr:`errors` maps the ``(identifier,
+    language)`` pairs that failed to their exceptions, :attr:`completed`
+    lists the pairs that completed and :attr:`pending` the pairs that are
+    still incomplete.
+    """
+
+    def __init__(self, errors, completed=(), pending=(), message=None):
+        super(TransfluentWaitError, self).__init__(
+            message or '{0} file(s) failed'.format(len(errors))
+        )
+        self.errors = dict(errors)
+        self.completed = list(completed)
+        self.pending = list(pending)
+
+
+class TransfluentTimeout(TransfluentWaitError):
+    """
+    Raised by :meth:`Transfluent.wait_for_files` when the files do not
+    complete in time.  The ``(identifier, language)`` pairs that are still
+    incomplete are in :attr:`pending`.
+    """
+
+    def __init__(self, pending, errors=None, completed=()):
+        super(TransfluentTimeout, self).__init__(
+            errors or {}, completed, pending,
+            '{0} file(s) still incomplete'.format(len(pending))
+        )
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request while a :class:`CircuitBreaker` is
+    open.  :attr:`retry_after` is the number of seconds until the next
+    trial request is allowed.
+    """
+
+    def __init__(self, retry_after):
+        super(CircuitOpenError, self).__init__(
+            'Transfluent API is unavailable, retry in {0:.1f} seconds'
+            .format(retry_after)
+        )
+        self.retry_after = retry_after
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+_umask_cache = []
+
+
+def _umask():
+    # The umask can only be read by setting it, so it is read once.
+    if not _umask_cache:
+        umask = os.umask(0o022)
+        os.umask(umask)
+        _umask_cache.append(umask)
+    return _umask_cache[0]
+
+
+def _atomic_write(path, chunks):
+    """
+    Write an iterable of byte strings to `path` atomically: the data is
+    written to a temporary file in the same directory, which is renamed
+    over `path` once complete.  Readers never see a partially written file.
+    The file keeps the permissions of the file it replaces, and a new file
+    gets the default permissions of the current umask.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~_umask()
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    import tempfile
+    fd, tmp = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        _replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _file_hash(path, chunk_size=64 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _find_source_files(directory, patterns):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+def _output_path(source, output, locale):
+    """
+    Return the path of the translation of the `source` file into `locale`,
+    both relative to the synchronized directory.
+    """
+    return os.path.normpath(os.path.join(
+        os.path.dirname(source),
+        output.format(
+            locale=locale,
+            name=os.path.splitext(os.path.basename(source))[0]
+        )
+    ))
+
+
+def sync(client, directory, source_language, targets, patterns=('*.pot',),
+         identifier_prefix='', output='{locale}/LC_MESSAGES/{name}.po',
+         type='po-file', manifest=None, max_workers=8, wait=True,
+         timeout=None, pull_all=False, log=None, **kwargs):
+    """
+    Synchronize a tree of resource files with Transfluent.
+
+    The source files matching `patterns` under `directory` are uploaded
+    with :meth:`Transfluent.file_save` and ordered into the `targets`
+    languages with :meth:`Transfluent.file_translate`, `max_workers` files
+    at a time.  If a :class:`Manifest` is given, files that have not
+    changed since the last sync are skipped.  Unless `wait` is false, the
+    translations are then waited for with
+    :meth:`Transfluent.wait_for_files` and written next to the source file
+    atomically, at the path given by the `output` template.
+
+    Translations that were ordered but not written, because `wait` is
+    false, the wait timed out or the download failed, are recorded as
+    pending in the manifest and downloaded by the next sync.  An error
+    with one file or translation is reported in ``'errors'`` and does not
+    stop the others.
+
+    :param targets:
+        A dict of target language ids and the locale names used in the
+        `output` template, e.g. ``{11: 'fi'}``.
+
+    :param identifier_prefix:
+        A prefix for the file identifiers, which are otherwise the paths of
+        the source files relative to `directory` without the extension.
+
+    :param output:
+        The path of a translated file relative to the directory of its
+        source file, with the ``{locale}`` and ``{name}`` placeholders.
+
+    :param pull_all:
+        Whether to also download the translations of unchanged files.
+
+    :param log:
+        Optional. A function called with a line of progress output.
+
+    Any other keyword arguments are passed to
+    :meth:`Transfluent.file_translate`.
+
+    :return:
+        A dict with the lists of ``'uploaded'``, ``'skipped'`` and
+        ``'written'`` files, a dict of ``'errors'`` and a dict of
+        ``'timings'`` of each phase in seconds.
+    """
+    log = log or (lambda line: None)
+    timings = {}
+    errors = {}
+    started = time.time()
+
+    # The translations written by an earlier sync may match `patterns`
+    # too, and must not be uploaded as sources.
+    paths = list(_find_source_files(directory, patterns))
+    outputs = set(_output_path(path, output, locale) for path in paths
+                  for locale in targets.values())
+    files = {}
+    for path in paths:
+        if os.path.normpath(path) in outputs:
+            continue
+        identifier = identifier_prefix + os.path.splitext(path)[0].replace(
+            os.sep, '/'
+        )
+        files[identifier] = path
+    saved = {} if manifest is None else manifest.file_hashes(source_language)
+    changed = {}
+    skipped = []
+    for identifier, path in sorted(iteritems(files)):
+        hash = _file_hash(os.path.join(directory, path))
+        if saved.get(identifier) == hash:
+            skipped.append(path)
+        else:
+            changed[identifier] = hash
+    timings['scan'] = time.time() - started
+
+    def upload(identifier):
+        path = os.path.join(directory, files[identifier])
+        with open(path, 'rb') as f:
+            client.file_save(identifier, source_language, f, type)
+        client.file_translate(identifier, source_language, list(targets),
+                              **kwargs)
+        log('uploaded {0}'.format(files[identifier]))
+
+    started = time.time()
+    identifiers = sorted(changed)
+    uploaded = []
+    results = _map_concurrently(upload, identifiers, max_workers)
+    for identifier, (_, error) in zip(identifiers, results):
+        if error is None:
+            uploaded.append(files[identifier])
+            if manifest is not None:
+                manifest.update_file(identifier, source_language,
+                                     changed[identifier], targets)
+        else:
+            errors[files[identifier]] = error
+            log('failed to upload {0}: {1}'.format(files[identifier], error))
+    timings['upload'] = time.time() - started
+
+    written = []
+    if wait:
+        started = time.time()
+        pulled = sorted(files) if pull_all else [
+            identifier for identifier in identifiers
+            if files[identifier] in uploaded
+        ]
+        pairs = set((identifier, language) for identifier in pulled
+                    for language in targets)
+        if manifest is not None:
+            languages = dict(
+                (text_type(language), language) for language in targets
+            )
+            pairs.update(
+                (identifier, languages[language])
+                for identifier, language in manifest.pending_files()
+                if identifier in files and language in languages
+            )
+
+        def describe(identifier, language):
+            return '{0} ({1})'.format(files[identifier], targets[language])
+
+        try:
+            for identifier, language, content in client.wait_for_files(
+                    sorted(pairs), timeout=timeout,
+                    max_concurrency=max_workers, read=True):
+                path = os.path.join(directory, _output_path(
+                    files[identifier], output, targets[language]
+                ))
+                if isinstance(content, text_type):
+                    content = content.encode('utf-8')
+                try:
+                    _atomic_write(path, [content])
+                except EnvironmentError as exc:
+                    errors[describe(identifier, language)] = exc
+                    log('failed to write {0}: {1}'.format(
+                        describe(identifier, language), exc
+                    ))
+                    continue
+                if manifest is not None:
+                    manifest.remove_pending_file(identifier, language)
+                written.append(os.path.relpath(path, directory))
+                log('wrote {0}'.format(written[-1]))
+        except TransfluentWaitError as exc:
+            for (identifier, language), error in iteritems(exc.errors):
+                errors[describe(identifier, language)] = error
+                log('failed to download {0}: {1}'.format(
+                    describe(identifier, language), error
+                ))
+            for identifier, language in exc.pending:
+                errors[describe(identifier, language)] = exc
+                log('timed out waiting for {0}'.format(
+                    describe(identifier, language)
+                ))
+        timings['download'] = time.time() - started
+
+    return {
+        'uploaded': uploaded,
+        'skipped': skipped,
+        'written': written,
+        'errors': errors,
+        'timings': timings,
+    }
+
+
+def _parse_target(value):
+    import argparse
+    language, _, locale = value.partition(':')
+    try:
+        return int(language), locale or language
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected LANGUAGE_ID[:LOCALE], got {0!r}'.format(value)
+        )
+
+
+def main(argv=None):
+    """The ``transfluent`` command line interface."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='transfluent',
+        description='Command line interface for the Transfluent API.'
+    )
+    parser.add_argument('--version', action='version', version=__version__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    parser_sync = commands.add_parser(
+        'sync',
+        help='upload changed resource files, order their translations and '
+             'write back the completed translations'
+    )
+    parser_sync.add_argument('directory', help='the locale directory')
+    parser_sync.add_argument(
+        '--token', default=os.environ.get('TRANSFLUENT_TOKEN'),
+        help='the authentication token (default: $TRANSFLUENT_TOKEN)'
+    )
+    parser_sync.add_argument('--url', help='the base URL of the API')
+    parser_sync.add_argument(
+        '--transport', default='requests', choices=sorted(TRANSPORTS),
+        help='the HTTP library to use; http.client starts faster '
+             '(default: requests)'
+    )
+    parser_sync.add_argument(
+        '--source-language', type=int, default=1,
+        help='the language id of the source files (default: 1)'
+    )
+    parser_sync.add_argument(
+        '--target', dest='targets', action='append', type=_parse_target,
+        required=True, metavar='LANGUAGE_ID[:LOCALE]',
+        help='a target language and the locale name of its directory; '
+             'may be repeated'
+    )
+    parser_sync.add_argument(
+        '--pattern', dest='patterns', action='append',
+        help='a glob pattern of source file names; may be repeated '
+             '(default: *.pot)'
+    )
+    parser_sync.add_argument('--identifier-prefix', default='',
+                             help='a prefix for the file identifiers')
+    parser_sync.add_argument(
+        '--output', default='{locale}/LC_MESSAGES/{name}.po',
+        help='the path of a translation relative to its source file '
+             '(default: {locale}/LC_MESSAGES/{name}.po)'
+    )
+    parser_sync.add_argument('--type', default='po-file',
+                             help='the file type (default: po-file)')
+    parser_sync.add_argument(
+        '--manifest', default='.transfluent-manifest.sqlite',
+        help='the manifest of uploaded files, relative to the directory '
+             '(default: .transfluent-manifest.sqlite)'
+    )
+    parser_sync.add_argument('--workers', type=int, default=8,
+                             help='the number of concurrent requests')
+    parser_sync.add_argument('--level', type=int, default=3,
+                             help='the level of translators (default: 3)')
+    parser_sync.add_argument('--comment', default='',
+                             help='a comment to the translators')
+    parser_sync.add_argument('--no-wait', dest='wait', action='store_false',
+                             help='do not wait for the translations')
+    parser_sync.add_argument('--timeout', type=float,
+                             help='the number of seconds to wait at most')
+    parser_sync.add_argument('--pull-all', action='store_true',
+                             help='also download the translations of '
+                                  'unchanged files')
+    parser_sync.add_argument('--quiet', action='store_true',
+                             help='only print the summary')
+    args = parser.parse_args(argv)
+
+    if not args.token:
+        parser.error('a token is required, use --token or $TRANSFLUENT_TOKEN')
+
+    def log(line):
+        if not args.quiet:
+            sys.stderr.write(line + '\n')
+
+    manifest = Manifest(os.path.join(args.directory, args.manifest))
+    client = Transfluent(token=args.token, url=args.url,
+                         transport=args.transport)
+    try:
+        started = time.time()
+        rv = sync(
+            client, args.directory, args.source_language,
+            dict(args.targets), patterns=args.patterns or ['*.pot'],
+            identifier_prefix=args.identifier_prefix, output=args.output,
+            type=args.type, manifest=manifest, max_workers=args.workers,
+            wait=args.wait, timeout=args.timeout, pull_all=args.pull_all,
+            log=log, level=args.level, comment=args.comment
+        )
+    finally:
+        client.close()
+        manifest.close()
+    timings = ', '.join(
+        '{0} {1:.1f}s'.format(phase, rv['timings'][phase])
+        for phase in ('scan', 'upload', 'download') if phase in rv['timings']
+    )
+    sys.stderr.write(
+        '{0} uploaded, {1} unchanged, {2} written, {3} failed in {4:.1f}s '
+        '({5})\n'.format(
+            len(rv['uploaded']), len(rv['skipped']), len(rv['written']),
+            len(rv['errors']), time.time() - started, timings
+        )
+    )
+    return 1 if rv['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
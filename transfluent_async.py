@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    transfluent_async
+    ~~~~~~~~~~~~~~~~~
+
+    An asyncio client for the Transfluent API built on aiohttp.
+
+    :copyright: (c) 2013-2016 by Janne Vanhala.
+    :license: BSD, see LICENSE for more details.
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from transfluent import BaseTransfluent, TransfluentError
+
+
+def _form_items(data):
+    """
+    Flatten `data` to a list of ``(key, value)`` string pairs the same way
+    requests does, so that list values such as ``target_languages[]`` are
+    sent as repeated fields.  Parameters that are already encoded are
+    returned as they are.
+    """
+    if isinstance(data, (bytes, str)):
+        return data
+    items = []
+    for key, value in (data or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            items.extend((key, str(v)) for v in value)
+        else:
+            items.append((key, str(value)))
+    return items
+
+
+async def wait_for_callback(order, timeout=None):
+    """
+    Wait for the callback of a :class:`transfluent.CallbackOrder` without
+    blocking the event loop, and return its query parameters.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def resolve(order):
+        loop.call_soon_threadsafe(
+            lambda: future.done() or future.set_result(order.params)
+        )
+
+    order.add_done_callback(resolve)
+    return await asyncio.wait_for(future, timeout)
+
+
+class AsyncTransfluent(BaseTransfluent):
+    """
+    An asyncio client for the Transfluent API.
+
+    The API is the same as :class:`transfluent.Transfluent`, except that all
+    methods and property getters return awaitables.  As property setters
+    cannot be awaited, the customer name and email are changed with
+    :meth:`set_customer_name` and :meth:`set_customer_email`.
+
+    ::
+
+        async with AsyncTransfluent(token='my-token') as client:
+            languages = await client.languages
+            status = await client.file_status('my-project/messages', 11)
+
+    :param token:
+        Optional. The authentication token. See :meth:`authenticate`.
+
+    :param session:
+        Optional. An :class:`aiohttp.ClientSession` to make the requests
+        with. An injected session is not closed by :meth:`close`.
+
+    :param limit:
+        The maximum number of simultaneous connections. Ignored when
+        `session` is given. Defaults to `100`.
+
+    :param limit_per_host:
+        The maximum number of simultaneous connections to the same host.
+        `0` means no limit. Ignored when `session` is given. Defaults to
+        `0`.
+    """
+
+    def __init__(self, token=None, session=None, limit=100,
+                 limit_per_host=0):
+        super(AsyncTransfluent, self).__init__(token)
+        self._owns_session = session is None
+        self._session = session
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+
+    @property
+    def session(self):
+        # aiohttp sessions should be created inside a running event loop,
+        # so the session is created on first use.
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit_per_host
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the session owned by this client.
+
+        Sessions passed to the constructor are left open, as they may be
+        shared with other clients.
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, path, data=None, headers=None):
+        url, kwargs = self._build_request(method, path, data, headers)
+        for key in ('params', 'data'):
+            if key in kwargs:
+                kwargs[key] = _form_items(kwargs[key])
+        async with self.session.request(method, url, **kwargs) as response:
+            content = await response.read()
+        try:
+            data = json.loads(content.decode('utf-8'))
+        except ValueError:
+            if response.status != 200:
+                raise
+            return content
+        if response.status != 200:
+            raise TransfluentError(response, data)
+        return data['response']
+
+    async def authenticate(self, email, password):
+        data = {'email': email, 'password': password}
+        response = await self._request('GET', 'authenticate', data)
+        self.token = response['token']
+
+    @property
+    def customer_name(self):
+        return self._authed_request('GET', 'customer/name')
+
+    async def set_customer_name(self, name):
+        await self._authed_request('POST', 'customer/name', {'name': name})
+
+    @property
+    def customer_email(self):
+        return self._authed_request('GET', 'customer/email')
+
+    async def set_customer_email(self, email):
+        await self._authed_request('POST', 'customer/email', {'email': email})
+
+    async def is_file_complete(self, identifier, language):
+        status = await self.file_status(identifier, language)
+        return status['progress'] == '100%'